@@ -0,0 +1,83 @@
+from shop.models import OutOfStockError, Product
+
+
+class GuestCartItem:
+    """Позиция гостевой корзины. Идентификатор позиции - id товара"""
+
+    def __init__(self, product, quantity):
+        self.id = product.pk
+        self.item = product
+        self.product_quantity = quantity
+
+    @property
+    def item_price(self):
+        return self.item.price * self.product_quantity
+
+
+class GuestCart:
+    """Корзина гостя в данных сессии: не создаёт строк Cart/CartItem.
+
+    Товары не резервируются, пока корзина не перенесена в БД при входе.
+    """
+    SESSION_KEY = 'cart'
+
+    pk = None
+    user = None
+
+    def __init__(self, session):
+        self.session = session
+        self._lines = None
+
+    def _quantities(self):
+        return {int(pk): quantity for pk, quantity in self.session.get(self.SESSION_KEY, {}).items()}
+
+    def _store(self, quantities):
+        self.session[self.SESSION_KEY] = {str(pk): quantity for pk, quantity in quantities.items()}
+        self._lines = None
+
+    def lines(self):
+        if self._lines is None:
+            quantities = self._quantities()
+            products = Product.objects.in_bulk(quantities) if quantities else {}
+            self._lines = [GuestCartItem(products[pk], quantity)
+                           for pk, quantity in quantities.items() if pk in products]
+        return self._lines
+
+    def quantities(self):
+        """Позиции корзины в виде {product_id: quantity}"""
+        return self._quantities()
+
+    @property
+    def total(self):
+        return sum((line.item_price for line in self.lines()), 0)
+
+    def is_empty(self):
+        return not self.session.get(self.SESSION_KEY)
+
+    def get_line(self, line_id):
+        return next((line for line in self.lines() if line.id == int(line_id)), None)
+
+    def _check_stock(self, product, quantity):
+        if quantity > product.stock_quantity:
+            raise OutOfStockError('Недостаточно товара на складе')
+
+    def add(self, product, quantity):
+        quantities = self._quantities()
+        quantities[product.pk] = quantities.get(product.pk, 0) + quantity
+        self._check_stock(product, quantities[product.pk])
+        self._store(quantities)
+
+    def set_quantity(self, line, quantity):
+        self._check_stock(line.item, quantity)
+        quantities = self._quantities()
+        quantities[line.id] = quantity
+        self._store(quantities)
+
+    def remove(self, line):
+        quantities = self._quantities()
+        quantities.pop(line.id, None)
+        self._store(quantities)
+
+    def clear(self):
+        self.session.pop(self.SESSION_KEY, None)
+        self._lines = None
@@ -0,0 +1,103 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.test.utils import override_settings
+
+from cart.models import Cart
+from shop.models import Category, CustomUser, Product
+
+EMAIL = 'benchmark-cart-{}@example.com'
+PASSWORD = 'benchmark-password'
+
+# Прежний профиль: журнал отката, полная синхронизация, отложенные транзакции
+# и новое соединение на каждый запрос
+BASELINE = {
+    'pragmas': {'busy_timeout': 5000, 'journal_mode': 'delete', 'synchronous': 'full'},
+    'transaction_mode': None,
+    'persistent': False,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пропускную способность параллельного добавления в корзину '
+        'с прежними настройками SQLite и с профилем из settings.SQLITE_PRAGMAS. '
+        'Пишет в базу по умолчанию - запускайте на копии (SQLITE_PATH)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--operations', type=int, default=200, help='Добавлений на одного исполнителя')
+
+    def worker(self, profile, cart_id, product_id, operations, stats):
+        if profile['persistent']:
+            connection.ensure_connection()
+            connection.transaction_mode = profile['transaction_mode']
+        done = errors = 0
+        try:
+            cart = Cart.objects.get(pk=cart_id)
+            product = Product.objects.get(pk=product_id)
+            for _ in range(operations):
+                if not profile['persistent']:
+                    connection.close()
+                    connection.ensure_connection()
+                    connection.transaction_mode = profile['transaction_mode']
+                try:
+                    cart.add(product, 1)
+                    done += 1
+                except OperationalError:
+                    errors += 1
+        finally:
+            connection.close()
+        stats.append((done, errors))
+
+    def run(self, label, profile, carts, product_id, operations):
+        stats = []
+        with override_settings(SQLITE_PRAGMAS=profile['pragmas']):
+            # journal_mode сохраняется в файле базы - переключаем до старта исполнителей
+            connection.close()
+            connection.ensure_connection()
+            threads = [
+                threading.Thread(target=self.worker, args=(profile, cart_id, product_id, operations, stats))
+                for cart_id in carts
+            ]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+        done = sum(item[0] for item in stats)
+        errors = sum(item[1] for item in stats)
+        self.stdout.write(
+            f'{label}: {done / elapsed:.0f} добавлений/с, {done} успешно, '
+            f'{errors} ошибок "database is locked", {elapsed:.2f} с'
+        )
+        return done / elapsed
+
+    def handle(self, *args, **options):
+        workers, operations = options['workers'], options['operations']
+        users = [CustomUser.objects.create_user(EMAIL.format(index), PASSWORD) for index in range(workers)]
+        category = Category.objects.create(name='benchmark-cart', description='')
+        product = Product.objects.create(
+            name='benchmark-cart', description='', price=1, category=category,
+            stock_quantity=workers * operations * 2,
+        )
+        try:
+            carts = [Cart.objects.create(user=user).pk for user in users]
+            current = {
+                # Без SQLITE_JOURNAL_MODE в окружении сравнивается с WAL
+                'pragmas': {'journal_mode': 'wal', **settings.SQLITE_PRAGMAS},
+                'transaction_mode': settings.DATABASES['default'].get('OPTIONS', {}).get('transaction_mode'),
+                'persistent': settings.DATABASES['default'].get('CONN_MAX_AGE', 0) != 0,
+            }
+            before = self.run('Прежние настройки', BASELINE, carts, product.pk, operations)
+            after = self.run('Профиль SQLITE_PRAGMAS', current, carts, product.pk, operations)
+        finally:
+            connection.close()
+            CustomUser.objects.filter(pk__in=[user.pk for user in users]).delete()
+            category.delete()
+        self.stdout.write(self.style.SUCCESS(f'Ускорение: {after / before:.1f}x'))
@@ -0,0 +1,108 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from cart.models import Cart, CartItem
+from shop.models import AccountDeletion, Product
+
+
+def quote(model, field=None):
+    name = model._meta.db_table if field is None else model._meta.get_field(field).column
+    return connection.ops.quote_name(name)
+
+
+class Command(BaseCommand):
+    help = ('Удаляет истёкшие сессии с их гостевыми корзинами, корзины без владельца '
+            'и старые запросы на удаление аккаунта небольшими пачками')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--sleep', type=float, default=0.1,
+                            help='Пауза между пачками, секунд: даёт другим запросам доступ к БД')
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.pause = options['sleep']
+        now = timezone.now()
+
+        sessions = self.run_batches('Истёкшие сессии', lambda: self.delete_sessions(now))
+        orphans = self.run_batches('Корзины без владельца', self.delete_orphan_carts)
+        cutoff = now - timedelta(seconds=settings.PASSWORD_RESET_TIMEOUT)
+        tokens = self.run_batches('Запросы на удаление аккаунта', lambda: self.delete_tokens(cutoff))
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено сессий: {sessions}, корзин без владельца: {orphans}, токенов: {tokens}'
+        ))
+
+    def run_batches(self, label, delete_batch):
+        total = 0
+        while True:
+            # Каждая пачка - отдельная короткая транзакция
+            with transaction.atomic():
+                deleted = delete_batch()
+            total += deleted
+            if deleted:
+                self.stdout.write(f'{label}: удалено {total}')
+            if deleted < self.batch_size:
+                return total
+            time.sleep(self.pause)
+
+    def select_ids(self, cursor, sql, params):
+        cursor.execute(f'{sql} LIMIT %s', [*params, self.batch_size])
+        return [row[0] for row in cursor.fetchall()]
+
+    def delete_in(self, cursor, table, column, ids):
+        if ids:
+            cursor.execute(f'DELETE FROM {table} WHERE {column} IN ({", ".join(["%s"] * len(ids))})', ids)
+
+    def delete_carts(self, cursor, cart_ids):
+        if not cart_ids:
+            return
+        # Позиции старых корзин держат резерв товаров - возвращаем его одним запросом
+        reserved = CartItem.objects.filter(cart_item__in=cart_ids).order_by().values_list('item').annotate(
+            quantity=Sum('product_quantity')
+        )
+        Product.objects.release_many(dict(reserved))
+        self.delete_in(cursor, quote(CartItem), quote(CartItem, 'cart_item'), cart_ids)
+        self.delete_in(cursor, quote(Cart), quote(Cart, 'id'), cart_ids)
+
+    def delete_sessions(self, now):
+        with connection.cursor() as cursor:
+            keys = self.select_ids(
+                cursor,
+                f'SELECT {quote(Session, "session_key")} FROM {quote(Session)} '
+                f'WHERE {quote(Session, "expire_date")} < %s',
+                [Session._meta.get_field('expire_date').get_db_prep_value(now, connection)],
+            )
+            if keys:
+                cart_ids = list(Cart.objects.filter(session__in=keys).values_list('pk', flat=True))
+                self.delete_carts(cursor, cart_ids)
+                self.delete_in(cursor, quote(Session), quote(Session, 'session_key'), keys)
+        return len(keys)
+
+    def delete_orphan_carts(self):
+        with connection.cursor() as cursor:
+            cart_ids = self.select_ids(
+                cursor,
+                f'SELECT {quote(Cart, "id")} FROM {quote(Cart)} '
+                f'WHERE {quote(Cart, "user")} IS NULL AND {quote(Cart, "session")} IS NULL',
+                [],
+            )
+            self.delete_carts(cursor, cart_ids)
+        return len(cart_ids)
+
+    def delete_tokens(self, cutoff):
+        with connection.cursor() as cursor:
+            ids = self.select_ids(
+                cursor,
+                f'SELECT {quote(AccountDeletion, "id")} FROM {quote(AccountDeletion)} '
+                f'WHERE {quote(AccountDeletion, "created_at")} < %s',
+                [AccountDeletion._meta.get_field('created_at').get_db_prep_value(cutoff, connection)],
+            )
+            self.delete_in(cursor, quote(AccountDeletion), quote(AccountDeletion, 'id'), ids)
+        return len(ids)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from cart.models import Cart, items_total_subquery
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает суммы всех корзин одним запросом (исправление рассинхронизации)'
+
+    def handle(self, *args, **options):
+        updated = Cart.objects.update(total=items_total_subquery())
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано корзин: {updated}'))
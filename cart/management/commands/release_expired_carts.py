@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from cart.models import CartItem
+
+
+class Command(BaseCommand):
+    help = 'Снимает резерв товаров в корзинах, которые давно не изменялись'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--age', type=int, default=settings.CART_RESERVATION_AGE,
+                            help='Возраст корзины в секундах')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=options['age'])
+        deleted, _ = CartItem.objects.filter(cart_item__updated_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Удалено позиций: {deleted}'))
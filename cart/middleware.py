@@ -1,26 +1,44 @@
+import time
+
+from django.conf import settings
 from django.utils.deprecation import MiddlewareMixin
-from .utils import get_or_create_cart
+from django.utils.functional import SimpleLazyObject
+from .utils import get_cart
+
+
+def is_cart_exempt(path):
+    """Проверяет, нужна ли корзина для данного пути"""
+    return path.startswith(tuple(getattr(settings, 'CART_EXEMPT_PATHS', ())))
 
 
 class CartMiddleware(MiddlewareMixin):
 
     def process_request(self, request):
-        request.cart = get_or_create_cart(request)
+        # Корзина вычисляется только при первом обращении к request.cart
+        if is_cart_exempt(request.path_info):
+            return
+        request.cart = SimpleLazyObject(lambda: get_cart(request))
 
 
-class CartSessionMiddleware:
+class SessionRefreshMiddleware:
+    """Продлевает срок жизни сессии не чаще раза в SESSION_REFRESH_INTERVAL секунд.
+
+    Вместе с SESSION_SAVE_EVERY_REQUEST = False сессия записывается в БД
+    только при изменении данных или при плановом продлении.
+    """
+    KEY = '_refreshed_at'
+
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
-        # Убедимся, что сессия существует
-        if not request.session.session_key:
-            request.session.create()
-
         response = self.get_response(request)
 
-        # Сохраняем сессию, если в корзине есть товары
-        if hasattr(request, 'cart') and request.cart.items.exists():
-            request.session.modified = True
+        session = request.session
+        # Не загружаем сессию ради проверки, если запрос к ней не обращался
+        if session.accessed and not session.modified and session.session_key and not session.is_empty():
+            now = int(time.time())
+            if now - session.get(self.KEY, 0) >= settings.SESSION_REFRESH_INTERVAL:
+                session[self.KEY] = now
 
         return response
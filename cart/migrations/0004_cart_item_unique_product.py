@@ -0,0 +1,36 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:46
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicates(apps, schema_editor):
+    # Склеиваем повторяющиеся товары в одной корзине перед добавлением ограничения
+    CartItem = apps.get_model("cart", "CartItem")
+    duplicates = (
+        CartItem.objects.values("cart_item", "item")
+        .annotate(rows=Count("id"), keep=Min("id"), quantity=Sum("product_quantity"))
+        .filter(rows__gt=1)
+    )
+    for row in duplicates:
+        CartItem.objects.filter(pk=row["keep"]).update(product_quantity=row["quantity"])
+        CartItem.objects.filter(cart_item=row["cart_item"], item=row["item"]).exclude(
+            pk=row["keep"]
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cart", "0003_alter_cart_session_alter_cart_user_and_more"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="cartitem",
+            constraint=models.UniqueConstraint(
+                fields=("cart_item", "item"), name="cart_item_unique_product"
+            ),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:28
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Min, OuterRef, Subquery, Sum
+
+
+def merge_user_carts(apps, schema_editor):
+    # Переносим позиции лишних корзин пользователя в самую старую, суммируя
+    # количество; резерв склада от этого не меняется
+    Cart = apps.get_model("cart", "Cart")
+    CartItem = apps.get_model("cart", "CartItem")
+    duplicates = (
+        Cart.objects.filter(user__isnull=False)
+        .values("user")
+        .annotate(carts=Count("id"), keep=Min("id"))
+        .filter(carts__gt=1)
+    )
+    for row in duplicates:
+        extra = Cart.objects.filter(user=row["user"]).exclude(pk=row["keep"])
+        lines = CartItem.objects.filter(cart_item__in=extra)
+        for item_id, quantity in lines.values("item").annotate(quantity=Sum("product_quantity")).values_list(
+            "item", "quantity"
+        ):
+            line, created = CartItem.objects.get_or_create(
+                cart_item_id=row["keep"], item_id=item_id, defaults={"product_quantity": quantity}
+            )
+            if not created:
+                CartItem.objects.filter(pk=line.pk).update(product_quantity=F("product_quantity") + quantity)
+        lines.delete()
+        extra.delete()
+        total = (
+            CartItem.objects.filter(cart_item=OuterRef("pk"))
+            .order_by()
+            .values("cart_item")
+            .annotate(total=Sum(F("item__price") * F("product_quantity")))
+            .values("total")
+        )
+        Cart.objects.filter(pk=row["keep"]).update(total=Subquery(total))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cart", "0005_cart_updated_idx"),
+        ("sessions", "0001_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_user_carts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="cart",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("user__isnull", False)),
+                fields=("user",),
+                name="cart_unique_user",
+            ),
+        ),
+    ]
@@ -1,7 +1,23 @@
-from django.db import models
+from django.db import connections, models, router, transaction
+from django.db.models import DecimalField, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Now
 from django.contrib.sessions.models import Session
+from django.utils import timezone
 from shop.models import Product, CustomUser
 
+MERGE_BATCH_SIZE = 200
+
+
+def items_total_subquery():
+    """Сумма позиций корзины одним подзапросом к БД"""
+    totals = CartItem.objects.filter(cart_item=OuterRef('pk')).order_by().values('cart_item').annotate(
+        total=Sum(F('item__price') * F('product_quantity'))
+    ).values('total')
+    return Coalesce(
+        Subquery(totals, output_field=DecimalField(max_digits=10, decimal_places=2)),
+        Value(0, output_field=DecimalField(max_digits=10, decimal_places=2)),
+    )
+
 
 class Cart(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='carts', null=True, blank=True)
@@ -22,32 +38,102 @@ class Cart(models.Model):
         ordering = ['session']
         verbose_name = 'Корзина'
         verbose_name_plural = 'Корзины'
+        # Поиск брошенных корзин по дате изменения
+        indexes = [models.Index(fields=['updated_at'], name='cart_updated_idx')]
+        # У пользователя одна корзина: иначе одновременные входы создают вторую
+        constraints = [
+            models.UniqueConstraint(fields=['user'], condition=Q(user__isnull=False), name='cart_unique_user'),
+        ]
         db_table = 'db_cart'
 
-    def _calculate_total(self):
-        self.total = sum(item.item_price for item in self.items.all())
-        super().save(update_fields=['total'])
+    def recalculate_total(self):
+        """Полный пересчёт суммы корзины. Используется только для исправления рассинхронизации"""
+        Cart.objects.filter(pk=self.pk).update(total=items_total_subquery())
+        self.refresh_from_db(fields=['total'])
+
+    @staticmethod
+    def shift_total(cart_id, product_id, quantity):
+        """Атомарно изменяет сумму корзины на цену товара, умноженную на quantity"""
+        if not quantity:
+            return
+        price = Subquery(Product.objects.filter(pk=product_id).values('price')[:1])
+        Cart.objects.filter(pk=cart_id).update(
+            total=F('total') + price * Value(quantity),
+            updated_at=Now(),
+        )
 
     def __str__(self):
         if self.user:
             return f"Корзина пользователя {self.user.email} - {self.total} руб."
         return f"Сессионная корзина {self.session.session_key}"
 
-    def merge_with_session(self, session_cart):
-        """Переносит товары из сессионной корзины"""
-        for item in session_cart.items.all():
-            existing_item = self.items.filter(item=item.item).first()
-            if existing_item:
-                existing_item.product_quantity += item.product_quantity
-                existing_item.save()
-            else:
-                item.cart_item = self
-                item.save()
-        session_cart.delete()
+    def lines(self):
+        return self.items.select_related('item')
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)  # Сначала сохраняем
-        self._calculate_total()        # Затем пересчитываем сумму
+    def is_empty(self):
+        return not self.items.exists()
+
+    def get_line(self, line_id):
+        return self.items.filter(pk=line_id).first()
+
+    def add(self, product, quantity):
+        line, created = CartItem.objects.get_or_create(
+            cart_item=self,
+            item=product,
+            defaults={'product_quantity': quantity}
+        )
+        if not created:
+            line.product_quantity += quantity
+            line.save()
+
+    def set_quantity(self, line, quantity):
+        line.product_quantity = quantity
+        line.save()
+
+    def remove(self, line):
+        line.delete()
+
+    def clear(self, release_stock=True):
+        """Удаляет все позиции корзины. При оформлении заказа резерв не снимается"""
+        self.items.all().delete(release_stock=release_stock)
+        self.total = 0
+
+    def merge_lines(self, quantities):
+        """Добавляет позиции {product_id: quantity} в корзину, суммируя количество.
+
+        Один INSERT ... ON CONFLICT на пачку позиций и один пересчёт суммы.
+        Резервирование товаров остаётся на вызывающей стороне.
+        """
+        lines = [(pk, quantity) for pk, quantity in quantities.items() if quantity > 0]
+        if not lines:
+            return
+        connection = connections[self._state.db or router.db_for_write(CartItem)]
+        table = connection.ops.quote_name(CartItem._meta.db_table)
+        added_at = CartItem._meta.get_field('added_at').get_db_prep_value(timezone.now(), connection)
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            for start in range(0, len(lines), MERGE_BATCH_SIZE):
+                batch = lines[start:start + MERGE_BATCH_SIZE]
+                cursor.execute(
+                    f'INSERT INTO {table} (cart_item_id, item_id, product_quantity, added_at) '
+                    f'VALUES {", ".join(["(%s, %s, %s, %s)"] * len(batch))} '
+                    f'ON CONFLICT (cart_item_id, item_id) '
+                    f'DO UPDATE SET product_quantity = {table}.product_quantity + excluded.product_quantity',
+                    [value for pk, quantity in batch for value in (self.pk, pk, quantity, added_at)],
+                )
+            self.recalculate_total()
+
+
+class CartItemQuerySet(models.QuerySet):
+    @transaction.atomic
+    def delete(self, release_stock=True):
+        # Вычитаем суммы удаляемых позиций одним агрегатом на каждую корзину
+        amounts = self.order_by().values_list('cart_item').annotate(amount=Sum(F('item__price') * F('product_quantity')))
+        for cart_id, amount in amounts:
+            Cart.objects.filter(pk=cart_id).update(total=F('total') - amount, updated_at=Now())
+        if release_stock:
+            reserved = self.order_by().values_list('item').annotate(quantity=Sum('product_quantity'))
+            Product.objects.release_many(dict(reserved))
+        return super().delete()
 
 
 class CartItem(models.Model):
@@ -56,6 +142,59 @@ class CartItem(models.Model):
     product_quantity = models.PositiveIntegerField(default=1)
     added_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CartItemQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_state()
+        return instance
+
+    def _remember_state(self):
+        # Запоминаем сохранённое состояние, чтобы считать изменения суммы корзины
+        self._saved_state = (self.cart_item_id, self.item_id, self.product_quantity)
+
+    @transaction.atomic
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        previous = None if adding else getattr(self, '_saved_state', None)
+        if previous is None and not adding:
+            previous = CartItem.objects.filter(pk=self.pk).values_list(
+                'cart_item_id', 'item_id', 'product_quantity'
+            ).first()
+
+        # Позиция корзины держит резерв на складе
+        if previous and previous[1] == self.item_id:
+            quantity = self.product_quantity - previous[2]
+            if quantity > 0:
+                Product.objects.reserve(self.item_id, quantity)
+            else:
+                Product.objects.release(self.item_id, -quantity)
+        else:
+            Product.objects.reserve(self.item_id, self.product_quantity)
+            if previous:
+                Product.objects.release(previous[1], previous[2])
+
+        super().save(*args, **kwargs)
+
+        if previous and previous[:2] == (self.cart_item_id, self.item_id):
+            Cart.shift_total(self.cart_item_id, self.item_id, self.product_quantity - previous[2])
+        else:
+            if previous:
+                Cart.shift_total(previous[0], previous[1], -previous[2])
+            Cart.shift_total(self.cart_item_id, self.item_id, self.product_quantity)
+        self._remember_state()
+
+    @transaction.atomic
+    def delete(self, *args, **kwargs):
+        cart_id, item_id, quantity = getattr(
+            self, '_saved_state', (self.cart_item_id, self.item_id, self.product_quantity)
+        )
+        result = super().delete(*args, **kwargs)
+        Cart.shift_total(cart_id, item_id, -quantity)
+        Product.objects.release(item_id, quantity)
+        return result
+
     @property
     def item_price(self):
         return self.item.price * self.product_quantity
@@ -67,5 +206,8 @@ class CartItem(models.Model):
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
         db_table = 'db_cart_item'
+        constraints = [
+            models.UniqueConstraint(fields=['cart_item', 'item'], name='cart_item_unique_product'),
+        ]
 
 
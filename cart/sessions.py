@@ -0,0 +1,21 @@
+from django.contrib.sessions.backends.db import SessionStore as DatabaseSessionStore
+
+
+class SessionStore(DatabaseSessionStore):
+    """Сессии в БД, которые знают, удалил ли cycle_key прежнюю запись.
+
+    При входе Django меняет ключ сессии и удаляет прежнюю запись. Если два
+    входа одновременно пришли с одной сессией, запись удаляет только один
+    из них - только он и переносит гостевую корзину (cart.utils.materialize_guest_cart).
+    """
+    # None - ключ не менялся, True/False - удалил ли этот запрос прежнюю запись
+    claimed = None
+
+    def cycle_key(self):
+        data = self._session
+        key = self.session_key
+        self.create()
+        self._session_cache = data
+        if key:
+            _, deleted = self.model.objects.filter(session_key=key).delete()
+            self.claimed = deleted.get(self.model._meta.label, 0) > 0
@@ -1,18 +1,39 @@
+from django.contrib import messages
 from django.contrib.auth.signals import user_logged_in
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Now
+from django.db.models.signals import pre_delete
 from django.dispatch import receiver
-from django.contrib.sessions.models import Session
-from .models import Cart
-from cart.utils import merge_carts
+from shop.models import Product
+from cart.models import Cart, CartItem
+from cart.utils import materialize_guest_cart
 
 
 @receiver(user_logged_in)
 def merge_session_cart(sender, request, user, **kwargs):
-    # Если есть сессионная корзина
-    if 'session_cart_id' in request.session:
-        try:
-            session_cart = Cart.objects.get(id=request.session['session_cart_id'], user=None)
-            user_cart, created = Cart.objects.get_or_create(user=user)
-            merge_carts(session_cart, user_cart)
-            del request.session['session_cart_id']
-        except Cart.DoesNotExist:
-            pass
\ No newline at end of file
+    # Гостевая корзина становится корзиной пользователя
+    if request is not None and hasattr(request, 'session'):
+        cart, shortages = materialize_guest_cart(request.session, user)
+        if shortages:
+            messages.warning(
+                request, f"Товара не хватило на складе, количество уменьшено: {', '.join(shortages)}",
+                fail_silently=True,
+            )
+
+
+@receiver(pre_delete, sender=Cart)
+def release_deleted_cart(sender, instance, **kwargs):
+    # Позиции удаляются каскадом без CartItem.delete - резерв снимаем здесь
+    Product.objects.release_many(dict(instance.items.values_list('item_id', 'product_quantity')))
+
+
+@receiver(pre_delete, sender=Product)
+def discount_deleted_product(sender, instance, **kwargs):
+    # Позиции товара удаляются каскадом - вычитаем их из сумм корзин одним UPDATE
+    # Цену берём из БД, а не из экземпляра: он мог быть загружен до изменения цены
+    quantity = CartItem.objects.filter(cart_item=OuterRef('pk'), item=instance).values('product_quantity')[:1]
+    price = Product.objects.filter(pk=instance.pk).values('price')[:1]
+    Cart.objects.filter(items__item=instance).update(
+        total=F('total') - Subquery(quantity) * Subquery(price),
+        updated_at=Now(),
+    )
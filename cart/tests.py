@@ -1,3 +1,372 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages import get_messages
+from django.contrib.auth.tokens import default_token_generator
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.contrib.sessions.models import Session
+from django.urls import reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+from django.utils import timezone
+
+from shop.models import AccountDeletion, Category, CustomUser, Order, OutOfStockError, Product
+from shop.utils import full_scans
+from .guest import GuestCart
+from .middleware import CartMiddleware
+from .models import Cart, CartItem
+from .sessions import SessionStore
+from .utils import create_order_from_cart, materialize_guest_cart
+
+
+def make_request(path='/cart/', user=None):
+    request = RequestFactory().get(path)
+    SessionMiddleware(lambda r: None).process_request(request)
+    request.user = user or AnonymousUser()
+    return request
+
+
+class CartMiddlewareTests(TestCase):
+    def test_cart_is_not_loaded_until_accessed(self):
+        user = CustomUser.objects.create_user('buyer@example.com', 'password', is_active=True)
+        request = make_request(user=user)
+        with self.assertNumQueries(0):
+            CartMiddleware(lambda r: None).process_request(request)
+        self.assertEqual(Cart.objects.count(), 0)
+
+        cart_id = request.cart.pk
+        with self.assertNumQueries(0):
+            self.assertEqual(request.cart.pk, cart_id)
+        self.assertEqual(Cart.objects.count(), 1)
+
+    @override_settings(CART_EXEMPT_PATHS=('/admin/',))
+    def test_exempt_paths_have_no_cart(self):
+        request = make_request('/admin/login/')
+        CartMiddleware(lambda r: None).process_request(request)
+        self.assertFalse(hasattr(request, 'cart'))
+
+
+class GuestCartTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Книги', description='')
+        self.book = Product.objects.create(name='Книга', description='', price=100, category=category, stock_quantity=5)
+
+    def test_browsing_creates_no_rows(self):
+        self.client.get(reverse('cart:view'))
+        self.client.get(reverse('shop:catalog'))
+        self.assertFalse(Session.objects.exists())
+        self.assertFalse(Cart.objects.exists())
+
+    def test_guest_cart_lives_in_session(self):
+        self.client.post(reverse('cart:add'), {'product_id': self.book.pk, 'quantity': 2})
+        self.client.post(reverse('cart:update_quantity', args=[self.book.pk]), {'quantity': 3})
+        self.assertFalse(Cart.objects.exists())
+
+        response = self.client.get(reverse('cart:view'))
+        [line] = response.context['cart_items']
+        self.assertEqual((line.item, line.product_quantity), (self.book, 3))
+        self.assertEqual(response.context['cart'].total, 300)
+        # Гостевая корзина не резервирует товар
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.stock_quantity, 5)
+
+    def test_guest_cannot_exceed_stock(self):
+        self.client.post(reverse('cart:add'), {'product_id': self.book.pk, 'quantity': 6})
+        self.assertNotIn(GuestCart.SESSION_KEY, self.client.session)
+
+    def test_materialized_on_login(self):
+        user = CustomUser.objects.create_user('buyer@example.com', 'password', is_active=True)
+        self.client.post(reverse('cart:add'), {'product_id': self.book.pk, 'quantity': 2})
+        self.client.post(reverse('shop:login'), {'email': 'buyer@example.com', 'password': 'password'})
+
+        cart = Cart.objects.get(user=user)
+        self.assertEqual(cart.items.get().product_quantity, 2)
+        self.assertEqual(cart.total, 200)
+        self.assertNotIn(GuestCart.SESSION_KEY, self.client.session)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.stock_quantity, 3)
+
+    def test_materialized_up_to_stock(self):
+        CustomUser.objects.create_user('buyer@example.com', 'password', is_active=True)
+        self.client.post(reverse('cart:add'), {'product_id': self.book.pk, 'quantity': 5})
+        Product.objects.filter(pk=self.book.pk).update(stock_quantity=3)
+        response = self.client.post(reverse('shop:login'), {'email': 'buyer@example.com', 'password': 'password'})
+
+        self.assertEqual(Cart.objects.get(user__email='buyer@example.com').items.get().product_quantity, 3)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.stock_quantity, 0)
+        warnings = [message for message in get_messages(response.wsgi_request) if message.level_tag == 'warning']
+        self.assertIn(self.book.name, str(warnings[0]))
+
+
+class CartTotalTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Книги', description='')
+        self.book = Product.objects.create(name='Книга', description='', price=100, category=category, stock_quantity=100)
+        self.pen = Product.objects.create(name='Ручка', description='', price=15, category=category, stock_quantity=100)
+        self.cart = Cart.objects.create()
+
+    def assertTotal(self, expected):
+        self.cart.refresh_from_db(fields=['total'])
+        self.assertEqual(self.cart.total, expected)
+
+    def test_total_follows_item_changes(self):
+        book = CartItem.objects.create(cart_item=self.cart, item=self.book, product_quantity=2)
+        CartItem.objects.create(cart_item=self.cart, item=self.pen, product_quantity=3)
+        self.assertTotal(245)
+
+        book = CartItem.objects.get(pk=book.pk)
+        book.product_quantity = 1
+        book.save()
+        self.assertTotal(145)
+
+        self.cart.items.filter(item=self.pen).delete()
+        self.assertTotal(100)
+
+    def test_update_does_not_depend_on_number_of_items(self):
+        for index in range(10):
+            product = Product.objects.create(name=f'Товар {index}', description='', price=1, category=self.book.category, stock_quantity=100)
+            CartItem.objects.create(cart_item=self.cart, item=product)
+        item = CartItem.objects.create(cart_item=self.cart, item=self.book)
+        # Резерв на складе, UPDATE позиции и UPDATE суммы корзины внутри точки сохранения
+        with self.assertNumQueries(5):
+            item.product_quantity = 5
+            item.save()
+        self.assertTotal(510)
+
+    def test_deleted_product_leaves_total(self):
+        self.cart.add(self.book, 2)
+        self.cart.add(self.pen, 1)
+        self.book.delete()
+        self.assertTotal(15)
+
+    def test_deleted_stale_product_uses_current_price(self):
+        stale = Product.objects.get(pk=self.book.pk)
+        Product.objects.filter(pk=self.book.pk).update(price=120)
+        self.cart.add(self.book, 2)
+        self.cart.add(self.pen, 1)
+        stale.delete()
+        self.assertTotal(15)
+
+    def test_recalculate_total_repairs_drift(self):
+        CartItem.objects.create(cart_item=self.cart, item=self.book, product_quantity=2)
+        Cart.objects.filter(pk=self.cart.pk).update(total=0)
+        self.cart.recalculate_total()
+        self.assertEqual(self.cart.total, 200)
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('buyer@example.com', 'password', is_active=True)
+        self.category = Category.objects.create(name='Книги', description='')
+
+    def fill_cart(self, cart, size):
+        for index in range(size):
+            product = Product.objects.create(name=f'Товар {cart.pk}-{index}', description='', price=10, category=self.category, stock_quantity=100)
+            CartItem.objects.create(cart_item=cart, item=product, product_quantity=2)
+
+    def checkout_queries(self, size):
+        # У пользователя одна корзина - каждому замеру свой покупатель
+        user = CustomUser.objects.create_user(f'buyer{size}@example.com', 'password', is_active=True)
+        cart = Cart.objects.create(user=user)
+        self.fill_cart(cart, size)
+        with CaptureQueriesContext(connection) as queries:
+            create_order_from_cart(cart, user)
+        return len(queries)
+
+    def test_creates_order_and_clears_cart(self):
+        cart = Cart.objects.create(user=self.user)
+        self.fill_cart(cart, 3)
+        order = create_order_from_cart(cart, self.user)
+
+        self.assertEqual(order.total, 60)
+        self.assertEqual(order.items.count(), 3)
+        self.assertFalse(cart.items.exists())
+        cart.refresh_from_db()
+        self.assertEqual(cart.total, 0)
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        self.assertEqual(self.checkout_queries(1), self.checkout_queries(10))
+
+    def test_empty_cart_is_rejected(self):
+        with self.assertRaises(ValueError):
+            create_order_from_cart(Cart.objects.create(user=self.user), self.user)
+        self.assertFalse(Order.objects.exists())
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Книги', description='')
+        self.book = Product.objects.create(name='Книга', description='', price=100, category=category, stock_quantity=5)
+        self.pen = Product.objects.create(name='Ручка', description='', price=15, category=category, stock_quantity=1)
+        self.cart = Cart.objects.create()
+
+    def stock(self, product):
+        product.refresh_from_db(fields=['stock_quantity'])
+        return product.stock_quantity
+
+    def test_cart_items_hold_reservation(self):
+        item = CartItem.objects.create(cart_item=self.cart, item=self.book, product_quantity=3)
+        self.assertEqual(self.stock(self.book), 2)
+
+        item.product_quantity = 1
+        item.save()
+        self.assertEqual(self.stock(self.book), 4)
+
+        item.delete()
+        self.assertEqual(self.stock(self.book), 5)
+
+    def test_oversell_is_rejected(self):
+        with self.assertRaises(OutOfStockError):
+            CartItem.objects.create(cart_item=self.cart, item=self.book, product_quantity=6)
+        self.assertEqual(self.stock(self.book), 5)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_reserve_many_is_all_or_nothing(self):
+        with self.assertRaises(OutOfStockError):
+            Product.objects.reserve_many({self.book.pk: 2, self.pen.pk: 2})
+        self.assertEqual(self.stock(self.book), 5)
+
+        # Один UPDATE внутри точки сохранения
+        with self.assertNumQueries(3):
+            Product.objects.reserve_many({self.book.pk: 2, self.pen.pk: 1})
+        self.assertEqual((self.stock(self.book), self.stock(self.pen)), (3, 0))
+
+    def test_checkout_keeps_reservation(self):
+        user = CustomUser.objects.create_user('buyer@example.com', 'password', is_active=True)
+        CartItem.objects.create(cart_item=self.cart, item=self.book, product_quantity=2)
+        create_order_from_cart(self.cart, user)
+        self.assertEqual(self.stock(self.book), 3)
+
+    def test_account_deletion_releases_reservation(self):
+        user = CustomUser.objects.create_user('leaving@example.com', 'password', is_active=True)
+        cart = Cart.objects.create(user=user)
+        cart.add(self.book, 4)
+        self.assertEqual(self.stock(self.book), 1)
+
+        token = default_token_generator.make_token(user)
+        AccountDeletion.objects.create(user=user, token=token)
+        self.client.get(reverse('shop:account_delete_confirm', args=[urlsafe_base64_encode(force_bytes(user.pk)), token]))
+
+        self.assertFalse(CustomUser.objects.filter(pk=user.pk).exists())
+        self.assertEqual(self.stock(self.book), 5)
+
+
+class CartMergeTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Книги', description='')
+        self.user = CustomUser.objects.create_user('buyer@example.com', 'password', is_active=True)
+        self.cart = Cart.objects.create(user=self.user)
+
+    def make_products(self, count):
+        start = Product.objects.count()
+        return [
+            Product.objects.create(name=f'Товар {start + index}', description='', price=10,
+                                   category=self.category, stock_quantity=100)
+            for index in range(count)
+        ]
+
+    def merge_queries(self, size):
+        products = self.make_products(size)
+        CartItem.objects.create(cart_item=self.cart, item=products[0], product_quantity=1)
+        with CaptureQueriesContext(connection) as queries:
+            self.cart.merge_lines({product.pk: 2 for product in products})
+        return len(queries)
+
+    def test_lines_are_summed(self):
+        self.merge_queries(3)
+        quantities = sorted(self.cart.items.values_list('product_quantity', flat=True))
+        self.assertEqual(quantities, [2, 2, 3])
+        self.assertEqual(self.cart.total, 70)
+
+    def test_constant_number_of_statements(self):
+        self.assertEqual(self.merge_queries(2), self.merge_queries(20))
+
+    def test_concurrent_logins_merge_guest_cart_once(self):
+        product, = self.make_products(1)
+        guest = SessionStore()
+        guest[GuestCart.SESSION_KEY] = {str(product.pk): 2}
+        guest.save()
+
+        # Два запроса входа с одной и той же гостевой сессией
+        first, second = SessionStore(guest.session_key), SessionStore(guest.session_key)
+        # Оба успели прочитать гостевую корзину до смены ключа
+        self.assertEqual(first[GuestCart.SESSION_KEY], second[GuestCart.SESSION_KEY])
+        for session in (first, second):
+            session.cycle_key()
+            materialize_guest_cart(session, self.user)
+
+        self.assertEqual(self.cart.items.get().product_quantity, 2)
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 98)
+
+
+class CleanupExpiredTests(TestCase):
+    def test_deletes_expired_sessions_with_carts_and_releases_stock(self):
+        category = Category.objects.create(name='Книги', description='')
+        book = Product.objects.create(name='Книга', description='', price=10, category=category, stock_quantity=10)
+        past, future = timezone.now() - timedelta(days=1), timezone.now() + timedelta(days=1)
+        expired = [Session.objects.create(session_key=f'expired{index}', session_data='', expire_date=past)
+                   for index in range(5)]
+        alive = Session.objects.create(session_key='alive', session_data='', expire_date=future)
+        for session in expired + [alive]:
+            CartItem.objects.create(cart_item=Cart.objects.create(session=session), item=book)
+        CartItem.objects.create(cart_item=Cart.objects.create(), item=book)
+
+        user = CustomUser.objects.create_user('old@example.com', 'password')
+        token = AccountDeletion.objects.create(user=user, token='old')
+        AccountDeletion.objects.filter(pk=token.pk).update(created_at=past - timedelta(days=30))
+        AccountDeletion.objects.create(user=user, token='fresh')
+
+        call_command('cleanup_expired', batch_size=2, sleep=0, stdout=StringIO())
+
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['alive'])
+        self.assertEqual(list(Cart.objects.values_list('session', flat=True)), ['alive'])
+        self.assertEqual(CartItem.objects.count(), 1)
+        self.assertEqual(list(AccountDeletion.objects.values_list('token', flat=True)), ['fresh'])
+        book.refresh_from_db()
+        self.assertEqual(book.stock_quantity, 9)
+
+
+class SessionWriteTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('buyer@example.com', 'password', is_active=True)
+        self.client.force_login(self.user)
+
+    def session_writes(self, *urls):
+        with CaptureQueriesContext(connection) as queries:
+            for url in urls:
+                self.client.get(url)
+        return [q['sql'] for q in queries if 'django_session' in q['sql'] and not q['sql'].startswith('SELECT')]
+
+    def test_read_only_browsing_does_not_write_session(self):
+        self.client.get(reverse('shop:profile'))  # Первое продление после входа
+        urls = [reverse('shop:profile'), reverse('shop:catalog'), reverse('shop:home')] * 3
+        self.assertEqual(self.session_writes(*urls), [])
+
+    @override_settings(SESSION_REFRESH_INTERVAL=0)
+    def test_expiry_is_refreshed_after_interval(self):
+        self.assertEqual(len(self.session_writes(reverse('shop:profile'))), 1)
+
+
+class QueryPlanTests(TestCase):
+    """Горячие запросы корзины должны идти по индексам, без полного чтения таблиц"""
+
+    def assertIndexed(self, queryset):
+        self.assertEqual(full_scans(queryset), [], str(queryset.query))
+
+    def test_cart_lookup(self):
+        self.assertIndexed(Cart.objects.filter(user_id=1))
+        self.assertIndexed(Cart.objects.filter(session_id='key'))
+
+    def test_cart_line(self):
+        self.assertIndexed(CartItem.objects.filter(cart_item_id=1, item_id=1))
+        self.assertIndexed(CartItem.objects.filter(cart_item_id=1))
+
+    def test_abandoned_carts(self):
+        self.assertIndexed(Cart.objects.filter(updated_at__lt=timezone.now()))
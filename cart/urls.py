@@ -10,4 +10,5 @@ urlpatterns = [
     path('add/<int:product_id>/', views.add_to_cart, name='add_by_id'),
     path('remove/<int:item_id>/', views.remove_from_cart, name='remove'),
     path('update/<int:item_id>/', views.update_quantity, name='update_quantity'),
+    path('checkout/', views.checkout, name='checkout'),
 ]
\ No newline at end of file
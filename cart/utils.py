@@ -1,43 +1,91 @@
-
-from django.contrib.sessions.backends.db import SessionStore
+from django.db import transaction
+from django.db.models import F, Sum
+from shop.models import Order, OrderItem, OutOfStockError, Product
+from .guest import GuestCart
 from .models import Cart, CartItem
-from django.contrib.sessions.models import Session
-from django.contrib.auth.models import AnonymousUser
 
 
 def get_or_create_cart(request):
-    # Создаем сессию, если ее нет
-    if not request.session.session_key:
-        request.session.create()
-
-    # Получаем или создаем объект сессии
-    session, _ = Session.objects.get_or_create(session_key=request.session.session_key)
-
     if request.user.is_authenticated:
         # Для авторизованных пользователей
         cart, created = Cart.objects.get_or_create(user=request.user)
+        return cart
+    # Для гостей корзина хранится в сессии и не создаёт строк в БД
+    return GuestCart(request.session)
+
+
+@transaction.atomic
+def materialize_guest_cart(session, user):
+    """Переносит гостевую корзину из сессии в корзину пользователя.
+
+    Возвращает корзину и названия товаров, количество которых пришлось
+    уменьшить до остатка на складе. Если прежнюю запись сессии при входе
+    удалил другой запрос, корзину переносит он: повторный перенос удвоил
+    бы количество и резерв.
+    """
+    if getattr(session, 'claimed', None) is False:
+        return None, []
+    guest_cart = GuestCart(session)
+    quantities = guest_cart.quantities()
+    if not quantities:
+        return None, []
+
+    # Пока товар лежал в гостевой корзине, остаток мог уменьшиться - переносим
+    # сколько есть, а закончившиеся товары не переносим вовсе
+    products = Product.objects.filter(pk__in=quantities).values_list('pk', 'stock_quantity', 'name')
+    lines, shortages = {}, []
+    for pk, stock, name in products:
+        lines[pk] = min(quantities[pk], stock)
+        if lines[pk] < quantities[pk]:
+            shortages.append(name)
+    lines = {pk: quantity for pk, quantity in lines.items() if quantity > 0}
+
+    cart, created = Cart.objects.get_or_create(user=user)
+    try:
+        Product.objects.reserve_many(lines)
+    except OutOfStockError:
+        # Остатки изменились одновременно с входом - гостевая корзина остаётся в сессии
+        return cart, []
+    cart.merge_lines(lines)
+    guest_cart.clear()
+    return cart, shortages
+
+
+def find_cart(request):
+    """Корзина текущего запроса без создания - для страниц, которые только читают.
+
+    Возвращает None, если у пользователя ещё нет корзины.
+    """
+    if not request.user.is_authenticated:
+        return GuestCart(request.session)
+    if not hasattr(request, '_cached_cart'):
+        cart = Cart.objects.filter(user=request.user).first()
+        if cart is None:
+            return None
+        request._cached_cart = cart
+    return request._cached_cart
+
+
+def get_cart(request):
+    """Возвращает корзину текущего запроса, обращаясь к БД не более одного раза"""
+    if not hasattr(request, '_cached_cart'):
+        request._cached_cart = get_or_create_cart(request)
+    return request._cached_cart
+
+
+@transaction.atomic
+def create_order_from_cart(cart, user):
+    """Оформляет заказ из корзины. Число запросов не зависит от количества позиций"""
+    lines = list(cart.items.values_list('item_id', 'product_quantity'))
+    if not lines:
+        raise ValueError('Корзина пуста')
 
-        # Если есть сессионная корзина - объединяем
-        session_cart = Cart.objects.filter(session=session).exclude(pk=cart.pk).first()
-        if session_cart:
-            cart.merge_with_session(session_cart)
-    else:
-        # Для гостей
-        cart, created = Cart.objects.get_or_create(session=session)
-
-    return cart
-
-
-def merge_carts(source_cart, target_cart):
-    for item in source_cart.items.all():
-        # Пытаемся найти такой же товар в целевой корзине
-        try:
-            target_item = target_cart.items.get(product=item.product)
-            target_item.quantity += item.quantity
-            target_item.save()
-        except CartItem.DoesNotExist:
-            # Если нет такого товара, просто переносим
-            item.cart = target_cart
-            item.save()
-    # Удаляем исходную корзину
-    source_cart.delete()
\ No newline at end of file
+    total = cart.items.aggregate(total=Sum(F('item__price') * F('product_quantity')))['total']
+    order = Order.objects.create(owner=user, total=total)
+    OrderItem.objects.bulk_create([
+        OrderItem(order_item=order, item_id=item_id, product_quantity=quantity)
+        for item_id, quantity in lines
+    ])
+    # Товары уже зарезервированы позициями корзины и теперь проданы
+    cart.clear(release_stock=False)
+    return order
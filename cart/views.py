@@ -1,8 +1,10 @@
+from django.http import Http404
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse
-from shop.models import Product
-from .models import CartItem, Cart
-from .utils import get_or_create_cart
+from django.contrib.auth.decorators import login_required
+from django.views.decorators.http import require_POST
+from shop.models import Product, OutOfStockError
+from .utils import get_cart, create_order_from_cart
 from django.contrib import messages
 
 
@@ -11,32 +13,33 @@ def add_to_cart(request, product_id=None):
         product_id = request.POST.get('product_id')
 
     item = get_object_or_404(Product, id=product_id)
-    cart = get_or_create_cart(request)
+    cart = get_cart(request)
 
     quantity = int(request.POST.get('quantity', 1))
 
-    cart_item, created = CartItem.objects.get_or_create(
-        cart_item=cart,
-        item=item,
-        defaults={'product_quantity': quantity}
-    )
-
-    if not created:
-        cart_item.product_quantity += quantity
-        cart_item.save()
+    try:
+        cart.add(item, quantity)
+    except OutOfStockError as e:
+        messages.error(request, str(e))
+        return redirect(reverse('shop:profile'))
 
-    cart._calculate_total()  # Обновляем общую сумму корзины
     messages.success(request, f"Товар {item.name} добавлен в корзину")
     return redirect(reverse('shop:profile'))  # Перенаправляем обратно в профиль
 
 
+def get_line_or_404(cart, item_id):
+    line = cart.get_line(item_id)
+    if line is None:
+        raise Http404("Товар не найден в корзине")
+    return line
+
+
 def remove_from_cart(request, item_id):
-    cart = get_or_create_cart(request)
-    item = get_object_or_404(CartItem, id=item_id, cart_item=cart)
+    cart = get_cart(request)
+    item = get_line_or_404(cart, item_id)
 
     if request.method == 'POST':
-        item.delete()
-        cart._calculate_total()
+        cart.remove(item)
         messages.success(request, "Товар удален из корзины")
         return redirect(reverse('shop:profile'))
 
@@ -44,42 +47,49 @@ def remove_from_cart(request, item_id):
 
 
 def update_quantity(request, item_id):
-    cart = get_or_create_cart(request)
-    item = get_object_or_404(CartItem, id=item_id, cart_item=cart)
+    cart = get_cart(request)
+    item = get_line_or_404(cart, item_id)
 
     if request.method == 'POST':
         quantity = int(request.POST.get('quantity', 1))
         if quantity > 0:
-            item.product_quantity = quantity
-            item.save()
-            cart._calculate_total()
-            messages.success(request, "Количество товара обновлено")
+            try:
+                cart.set_quantity(item, quantity)
+            except OutOfStockError as e:
+                messages.error(request, str(e))
+            else:
+                messages.success(request, "Количество товара обновлено")
         else:
-            item.delete()
+            cart.remove(item)
             messages.success(request, "Товар удален из корзины")
         return redirect(reverse('shop:profile'))
 
     return render(request, 'cart/update_quantity.html', {'item': item})
 
 
+@login_required
+@require_POST
+def checkout(request):
+    cart = get_cart(request)
+    try:
+        create_order_from_cart(cart, request.user)
+    except ValueError as e:
+        messages.error(request, str(e))
+    else:
+        messages.success(request, "Заказ оформлен")
+    return redirect(reverse('shop:profile'))
+
+
 def view_cart(request):
     try:
-        cart = get_or_create_cart(request)
-        # Используйте правильное имя поля для связи с элементами корзины
-        cart_items = cart.items.all()  # или другое правильное имя related_name
-        available_products = Product.objects.all()
         if request.user.is_authenticated:
-            return render(request, 'shop/profile.html', {
-                'cart': cart,
-                'items': cart_items,  # Передаем элементы корзины отдельно
-                'available_products': available_products
-            })
-        else:
-            return render(request, 'cart/view.html', {
-                'cart': cart,
-                'items': cart_items,  # Передаем элементы корзины отдельно
-                'available_products': available_products
-            })
+            # Корзина пользователя выводится в личном кабинете
+            return redirect(reverse('shop:profile'))
+        cart = get_cart(request)
+        return render(request, 'cart/view.html', {
+            'cart': cart,
+            'cart_items': cart.lines(),
+        })
     except Exception as e:
         print(f"Error: {e}")  # Для отладки
         raise
@@ -41,6 +41,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    'shop.middleware.QueryInstrumentationMiddleware',
+    'shop.middleware.ReplicaPinMiddleware',
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -48,8 +50,7 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     'cart.middleware.CartMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
-    'cart.middleware.CartSessionMiddleware',
+    'cart.middleware.SessionRefreshMiddleware',
 ]
 
 ROOT_URLCONF = "myshop.urls"
@@ -64,6 +65,7 @@ TEMPLATES = [
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
+                "shop.context_processors.category_tree",
             ],
         },
     },
@@ -74,12 +76,49 @@ WSGI_APPLICATION = "myshop.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Параметры соединения переопределяются переменными окружения для каждого окружения
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "NAME": os.environ.get("SQLITE_PATH", BASE_DIR / "db.sqlite3"),
+        # Соединение переиспользуется между запросами вместо открытия на каждый запрос
+        "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", 600)),
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {
+            # Блокировка на запись берётся в начале транзакции, а не при первом UPDATE:
+            # так конкурирующие транзакции ждут busy_timeout, а не падают с "database is locked"
+            "transaction_mode": os.environ.get("SQLITE_TRANSACTION_MODE", "IMMEDIATE"),
+        },
+    }
+}
+
+# Реплика для чтения: локально - второй файл SQLite (синхронизируется командой sync_replica),
+# в продакшене - настоящая реплика. Без SQLITE_REPLICA_PATH всё читается из основной базы
+if os.environ.get("SQLITE_REPLICA_PATH"):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "NAME": os.environ["SQLITE_REPLICA_PATH"],
+        "TEST": {"MIRROR": "default"},
     }
+DATABASE_REPLICA = "replica" if "replica" in DATABASES else None
+DATABASE_ROUTERS = ["shop.routers.PrimaryReplicaRouter"]
+
+# Сколько секунд после записи клиент читает только из основной базы
+REPLICA_PIN_SECONDS = int(os.environ.get("REPLICA_PIN_SECONDS", 10))
+
+# PRAGMA для каждого нового соединения SQLite (shop.db.configure_sqlite), применяются по порядку
+SQLITE_PRAGMAS = {
+    "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000)),
+    "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "normal"),
+    "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", 128 * 1024 * 1024)),
+    "cache_size": int(os.environ.get("SQLITE_CACHE_SIZE", -20000)),  # в КиБ
+    "temp_store": os.environ.get("SQLITE_TEMP_STORE", "memory"),
 }
+# journal_mode записывается в сам файл базы, поэтому WAL включается явно в окружении
+# (SQLITE_JOURNAL_MODE=wal), а не по умолчанию - иначе любая команда manage.py
+# переписывает db.sqlite3 из репозитория
+if os.environ.get("SQLITE_JOURNAL_MODE"):
+    SQLITE_PRAGMAS["journal_mode"] = os.environ["SQLITE_JOURNAL_MODE"]
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -130,5 +169,67 @@ AUTH_USER_MODEL = 'shop.CustomUser'
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
-SESSION_SAVE_EVERY_REQUEST = True
-SESSION_COOKIE_AGE = 1209600  # 2 недели
\ No newline at end of file
+# Кэш должен быть общим для всех процессов: по версии в нём процессы узнают об
+# изменении каталога (shop.navigation). LocMemCache у каждого процесса свой и не подходит.
+# По умолчанию - таблица в БД (создаётся миграцией shop), в продакшене - Redis/Memcached
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get("CACHE_BACKEND", "django.core.cache.backends.db.DatabaseCache"),
+        "LOCATION": os.environ.get("CACHE_LOCATION", "django_cache"),
+    }
+}
+
+# Сессия сохраняется только при изменении данных; срок жизни продлевается
+# не чаще раза в SESSION_REFRESH_INTERVAL секунд (cart.middleware.SessionRefreshMiddleware)
+SESSION_SAVE_EVERY_REQUEST = False
+SESSION_COOKIE_AGE = 1209600  # 2 недели
+SESSION_REFRESH_INTERVAL = 60 * 60 * 24
+
+# Сессии в БД, при входе сообщающие, какой запрос забрал прежнюю сессию с гостевой корзиной
+SESSION_ENGINE = 'cart.sessions'
+
+# Префиксы путей, для которых корзина не загружается
+CART_EXEMPT_PATHS = (
+    '/admin/',
+    '/static/',
+    MEDIA_URL,
+    '/shop/login.html',
+    '/shop/register.html',
+)
+
+# Время жизни резерва товаров в неактивной корзине, в секундах
+CART_RESERVATION_AGE = 60 * 60 * 24
+
+# Количество товаров на странице каталога
+CATALOG_PAGE_SIZE = 20
+
+# Количество заказов на странице истории в личном кабинете
+ORDER_HISTORY_PAGE_SIZE = 10
+
+# Очередь писем: число попыток и начальная задержка повтора в секундах
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_DELAY = 60
+# Через сколько секунд письмо, взятое упавшим обработчиком, снова уходит в очередь
+OUTBOX_CLAIM_TIMEOUT = 300
+
+# Размеры уменьшенных копий фото товаров (ширина, высота)
+PRODUCT_IMAGE_VARIANTS = {
+    'thumb': (200, 200),
+    'medium': (600, 600),
+}
+
+# Замер SQL по запросам (shop.middleware.QueryInstrumentationMiddleware): включается SQL_INSTRUMENTATION=1.
+# Форма запроса, повторённая больше порога, попадает в лог как вероятный N+1
+SQL_INSTRUMENTATION = os.environ.get("SQL_INSTRUMENTATION") == "1"
+SQL_N_PLUS_ONE_THRESHOLD = int(os.environ.get("SQL_N_PLUS_ONE_THRESHOLD", 5))
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "shop.sql": {"handlers": ["console"], "level": "INFO", "propagate": False},
+    },
+}
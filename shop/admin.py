@@ -1,28 +1,81 @@
 from django.contrib import admin
-from .models import Category, Product, Order, CustomUserManager, CustomUser
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from .models import Category, Product, Order, OrderItem, CustomUser
+
+
+class EstimatedCountPaginator(Paginator):
+    """Для списка без фильтров берёт оценку числа строк вместо COUNT(*) по всей таблице"""
+
+    @cached_property
+    def count(self):
+        if self.object_list.query.where:
+            return super().count
+        estimate = self.estimate(connections[self.object_list.db], self.object_list.model._meta.db_table)
+        return estimate if estimate and estimate > 0 else super().count
+
+    def estimate(self, connection, table):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+                row = cursor.fetchone()
+                return row[0] if row else None
+            if connection.vendor == 'sqlite':
+                # sqlite_stat1 появляется после ANALYZE; первое число в stat - строк в таблице.
+                # Без статистики честный COUNT(*): MAX(pk) врёт после удалений
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+                if cursor.fetchone():
+                    cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+                    row = cursor.fetchone()
+                    return int(row[0].split()[0]) if row else None
+        return None
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 @admin.register(CustomUser)
-class PersonAdmin(admin.ModelAdmin):
+class CustomUserAdmin(LargeTableAdmin):
     list_display = ('email', 'is_staff', 'is_active',)
-    list_filter = ['email', 'is_active']
+    list_filter = ['is_active', 'is_staff']
+    search_fields = ('email',)
 
 
 @admin.register(Category)
-class PersonAdmin(admin.ModelAdmin):
+class CategoryAdmin(admin.ModelAdmin):
     list_display = ('name', 'parent')
-    list_filter = ['name']
+    list_select_related = ('parent',)
+    search_fields = ('name',)
+    autocomplete_fields = ('parent',)
 
 
 @admin.register(Product)
-class PersonAdmin(admin.ModelAdmin):
+class ProductAdmin(LargeTableAdmin):
     list_display = ('name', 'price', 'stock_quantity', 'category')
-    list_filter = ["name", 'category']
-    search_fields = ('name', 'category')
+    list_select_related = ('category',)
+    list_filter = ['category']
+    search_fields = ('name', 'category__name')
+    autocomplete_fields = ('category',)
+
+
+class OrderItemInline(admin.TabularInline):
+    model = OrderItem
+    autocomplete_fields = ('item',)
+    extra = 0
 
 
 @admin.register(Order)
-class PersonAdmin(admin.ModelAdmin):
-    list_display = ('owner', 'status', 'total')
-    list_filter = ["owner", 'status']
-    search_fields = ('owner', 'status')
+class OrderAdmin(LargeTableAdmin):
+    list_display = ('id', 'owner_email', 'status', 'total', 'created_at')
+    list_select_related = ('owner',)
+    list_filter = ['status']
+    search_fields = ('owner__email',)
+    autocomplete_fields = ('owner',)
+    inlines = [OrderItemInline]
+
+    @admin.display(description='Email', ordering='owner__email')
+    def owner_email(self, obj):
+        return obj.owner.email
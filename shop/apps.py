@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class ShopConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "shop"
+
+    def ready(self):
+        import shop.signals
+        from shop.db import configure_sqlite
+        connection_created.connect(configure_sqlite, dispatch_uid='shop.configure_sqlite')
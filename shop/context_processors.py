@@ -0,0 +1,6 @@
+from .navigation import get_category_tree
+
+
+def category_tree(request):
+    # Передаём функцию: дерево загружается, только если шаблон его выводит
+    return {'category_tree': get_category_tree}
@@ -0,0 +1,68 @@
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Order, OrderItem, Product
+
+CHUNK_SIZE = 2000
+
+# Выгрузка: queryset, поле даты для фильтра и колонки (соединения выполняются в SQL)
+EXPORTS = {
+    'products': (
+        Product.objects.all(), 'created_at',
+        ['id', 'name', 'category__name', 'price', 'stock_quantity', 'rating_avg', 'created_at'],
+    ),
+    'orders': (
+        Order.objects.all(), 'created_at',
+        ['id', 'owner__email', 'status', 'total', 'created_at'],
+    ),
+    'order_items': (
+        OrderItem.objects.all(), 'order_item__created_at',
+        ['id', 'order_item_id', 'order_item__owner__email', 'item_id', 'item__name',
+         'item__category__name', 'item__price', 'product_quantity', 'order_item__created_at'],
+    ),
+}
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer: возвращает строку вместо записи"""
+
+    def write(self, value):
+        return value
+
+
+def day_start(value):
+    return timezone.make_aware(datetime.combine(value, time.min))
+
+
+def export_rows(kind, date_from=None, date_to=None):
+    """Возвращает заголовок и итератор строк выгрузки без загрузки всего набора в память.
+
+    date_from и date_to - даты в формате ГГГГ-ММ-ДД, обе границы включительно.
+    """
+    queryset, date_field, columns = EXPORTS[kind]
+    if date_from:
+        queryset = queryset.filter(**{f'{date_field}__gte': day_start(parse_date(date_from))})
+    if date_to:
+        queryset = queryset.filter(**{f'{date_field}__lt': day_start(parse_date(date_to) + timedelta(days=1))})
+    rows = queryset.order_by('pk').values_list(*columns).iterator(chunk_size=CHUNK_SIZE)
+    return columns, rows
+
+
+def stream_csv(columns, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_jsonl(columns, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+STREAMS = {'csv': stream_csv, 'jsonl': stream_jsonl}
@@ -2,7 +2,7 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm, SetPasswordForm, PasswordResetForm, \
     PasswordChangeForm
 from .models import CustomUser
-from django.contrib.auth import authenticate
+from django.contrib.auth.signals import user_login_failed
 from django.core.exceptions import ValidationError
 from django.contrib.auth.password_validation import validate_password
 from django.contrib.auth import get_user_model
@@ -60,11 +60,7 @@ class CustomUserLoginForm(AuthenticationForm):
         email = self.cleaned_data.get('email')
         if not email:
             raise ValidationError("Email обязателен")
-
-        # Проверяем, есть ли пользователь с таким email
-        if not User.objects.filter(email=email).exists():
-            raise ValidationError("Пользователь с таким email не найден")
-
+        # Существование пользователя проверяется в clean() тем же запросом
         return email
 
     def clean_password(self):
@@ -79,30 +75,26 @@ class CustomUserLoginForm(AuthenticationForm):
         password = cleaned_data.get('password')
 
         if email and password:
-            # Пробуем аутентифицировать
-            self.user_cache = authenticate(
-                request=self.request,
-                email=email,
-                password=password
-            )
-
-            # Если аутентификация не удалась
-            if not self.user_cache:
-                # Проверяем существует ли пользователь
-                user_exists = User.objects.filter(email=email).exists()
-
-                if user_exists:
-                    # Если существует, проверяем активность
-                    user = User.objects.get(email=email)
-                    if not user.is_active:
-                        raise ValidationError("Аккаунт не активирован. Пожалуйста, проверьте вашу почту")
-                    else:
-                        raise ValidationError("Неверный пароль")
-                else:
-                    raise ValidationError("Пользователь с таким email не найден")
+            # Один запрос к пользователю и одно вычисление хеша на попытку
+            user = User._default_manager.filter(email=email).first()
+            if user is None:
+                # Хешируем пароль и для несуществующего пользователя, чтобы не выдавать его временем ответа
+                User().set_password(password)
+                self._login_failed(email)
+                raise ValidationError("Пользователь с таким email не найден")
+            if not user.check_password(password):
+                self._login_failed(email)
+                raise ValidationError("Неверный пароль")
+            if not user.is_active:
+                self._login_failed(email)
+                raise ValidationError("Аккаунт не активирован. Пожалуйста, проверьте вашу почту")
+            self.user_cache = user
 
         return cleaned_data
 
+    def _login_failed(self, email):
+        user_login_failed.send(sender=__name__, credentials={'email': email}, request=self.request)
+
     def get_user(self):
         return self.user_cache
 
@@ -0,0 +1,57 @@
+import hashlib
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+# Параметры сохранения для каждого формата варианта
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def variant_path(product_id, digest, name, extension):
+    return os.path.join('products', 'variants', str(product_id), f'{digest}-{name}.{extension}')
+
+
+def render_variants(product_id, image_name):
+    """Создаёт уменьшенные копии изображения во всех форматах.
+
+    Имена файлов содержат хеш содержимого оригинала, поэтому их можно кэшировать
+    навсегда: новое изображение всегда получает новые адреса. Уже созданные
+    файлы повторно не пересчитываются. Функция не обращается к БД и может
+    выполняться в отдельном процессе.
+    """
+    with default_storage.open(image_name, 'rb') as original:
+        data = original.read()
+    digest = hashlib.sha256(data).hexdigest()[:16]
+
+    variants = {}
+    source = None
+    for name, size in settings.PRODUCT_IMAGE_VARIANTS.items():
+        variants[name] = {}
+        for extension, (image_format, options) in FORMATS.items():
+            path = variant_path(product_id, digest, name, extension)
+            variants[name][extension] = path
+            if default_storage.exists(path):
+                continue
+            if source is None:
+                source = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+            image = source.copy()
+            image.thumbnail(size, Image.LANCZOS)
+            if image_format == 'JPEG' and image.mode != 'RGB':
+                image = image.convert('RGB')
+            buffer = BytesIO()
+            image.save(buffer, image_format, **options)
+            default_storage.save(path, ContentFile(buffer.getvalue()))
+    return variants
+
+
+def delete_variants(variants):
+    for formats in variants.values():
+        for path in formats.values():
+            default_storage.delete(path)
@@ -0,0 +1,56 @@
+import time
+
+from django.contrib.auth import authenticate
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from shop.forms import CustomUserLoginForm
+from shop.models import CustomUser
+
+EMAIL = 'benchmark-login@example.com'
+PASSWORD = 'benchmark-password'
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Замеряет процессорное время и число запросов на одну попытку входа'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+
+    def measure(self, label, attempt, iterations):
+        with CaptureQueriesContext(connection) as queries:
+            attempt()
+        started = time.process_time()
+        for _ in range(iterations):
+            attempt()
+        cpu_ms = (time.process_time() - started) / iterations * 1000
+        self.stdout.write(f'{label}: {cpu_ms:.1f} мс CPU, {len(queries)} запросов на вход')
+        return cpu_ms
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        data = {'email': EMAIL, 'password': PASSWORD}
+
+        def login_form():
+            form = CustomUserLoginForm(None, data=data)
+            assert form.is_valid(), form.errors
+
+        def double_authenticate():
+            # Прежняя схема: authenticate() в форме и повторно во view
+            authenticate(email=EMAIL, password=PASSWORD)
+            authenticate(email=EMAIL, password=PASSWORD)
+
+        try:
+            with transaction.atomic():
+                CustomUser.objects.create_user(EMAIL, PASSWORD, is_active=True)
+                current = self.measure('Форма входа', login_form, iterations)
+                previous = self.measure('Двойной authenticate()', double_authenticate, iterations)
+                raise Rollback
+        except Rollback:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Экономия CPU на вход: {previous / current:.1f}x'))
@@ -0,0 +1,206 @@
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from datetime import datetime, timezone
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from cart.models import Cart, CartItem
+from shop.middleware import QueryStats
+from shop.models import Category, CustomUser, Order, OrderItem, Product
+
+PREFIX = 'loadtest'
+PASSWORD = 'loadtest-password'
+SCENARIOS = ['login', 'add_to_cart', 'update_quantity', 'view_cart', 'profile']
+
+
+def percentile(values, percent):
+    """Процентиль по ближайшему рангу"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный прогон view магазина и корзины на синтетических данных. '
+        'Печатает JSON с p50/p95/p99, пропускной способностью и числом запросов к БД. '
+        'Пишет в базу по умолчанию - запускайте на копии (SQLITE_PATH)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--orders-per-user', type=int, default=5)
+        parser.add_argument('--cart-items', type=int, default=3, help='Позиций в корзине каждого пользователя')
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--requests', type=int, default=50, help='Запросов одного исполнителя на сценарий')
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+        parser.add_argument('--seed', type=int, default=1, help='Зерно генератора данных и запросов')
+        parser.add_argument('--output', help='Файл для JSON; по умолчанию - stdout')
+        parser.add_argument('--keep', action='store_true', help='Не удалять сгенерированные данные')
+
+    def seed(self, options, rng):
+        categories = [
+            Category.objects.create(name=f'{PREFIX}-{index}', description='')
+            for index in range(options['categories'])
+        ]
+        Product.objects.bulk_create(
+            Product(
+                name=f'{PREFIX}-{index}', description='', category=rng.choice(categories),
+                price=rng.randint(100, 100000) / 100, stock_quantity=1_000_000,
+            )
+            for index in range(options['products'])
+        )
+        product_ids = list(Product.objects.filter(category__in=categories).values_list('pk', flat=True))
+
+        # Хеш пароля считается один раз: он одинаков для всех пользователей
+        password = make_password(PASSWORD)
+        CustomUser.objects.bulk_create(
+            CustomUser(email=f'{PREFIX}-{index}@example.com', password=password, is_active=True)
+            for index in range(options['users'])
+        )
+        users = list(CustomUser.objects.filter(email__startswith=f'{PREFIX}-').order_by('pk'))
+
+        orders = Order.objects.bulk_create(
+            Order(owner=user, total=0) for user in users for _ in range(options['orders_per_user'])
+        )
+        if orders and orders[0].pk is None:
+            orders = list(Order.objects.filter(owner__in=users))
+        prices = dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'price'))
+        items = []
+        for order in orders:
+            for product_id in rng.sample(product_ids, min(3, len(product_ids))):
+                items.append(OrderItem(order_item=order, item_id=product_id, product_quantity=rng.randint(1, 3)))
+                order.total += prices[product_id] * items[-1].product_quantity
+        OrderItem.objects.bulk_create(items, batch_size=1000)
+        Order.objects.bulk_update(orders, ['total'], batch_size=1000)
+
+        # Корзины пользователей с резервом склада, как после обычных добавлений
+        carts = Cart.objects.bulk_create(Cart(user=user, total=0) for user in users)
+        if carts and carts[0].pk is None:
+            carts = list(Cart.objects.filter(user__in=users))
+        lines, reserved = [], Counter()
+        for cart in carts:
+            for product_id in rng.sample(product_ids, min(options['cart_items'], len(product_ids))):
+                lines.append(CartItem(cart_item=cart, item_id=product_id, product_quantity=rng.randint(1, 3)))
+                cart.total += prices[product_id] * lines[-1].product_quantity
+                reserved[product_id] += lines[-1].product_quantity
+        CartItem.objects.bulk_create(lines, batch_size=1000)
+        Cart.objects.bulk_update(carts, ['total'], batch_size=1000)
+        Product.objects.reserve_many(reserved)
+        return categories, users, product_ids
+
+    def cleanup(self, categories, users):
+        CustomUser.objects.filter(pk__in=[user.pk for user in users]).delete()
+        Category.objects.filter(pk__in=[category.pk for category in categories]).delete()
+
+    def prepare_client(self, scenario, user, product_ids, rng):
+        """Клиент в состоянии, нужном сценарию; возвращает функцию одного запроса"""
+        client = Client()
+        if scenario == 'login':
+            data = {'email': user.email, 'password': PASSWORD}
+            return lambda: client.post(reverse('shop:login'), data)
+        if scenario == 'view_cart':
+            # Гостевая корзина в сессии
+            for product_id in rng.sample(product_ids, min(5, len(product_ids))):
+                client.post(reverse('cart:add', args=[product_id]))
+            return lambda: client.get(reverse('cart:view'))
+
+        client.force_login(user)
+        if scenario == 'add_to_cart':
+            return lambda: client.post(reverse('cart:add', args=[rng.choice(product_ids)]))
+        if scenario == 'update_quantity':
+            product_id = rng.choice(product_ids)
+            client.post(reverse('cart:add', args=[product_id]))
+            line = user.carts.get().items.get(item_id=product_id)
+            url = reverse('cart:update_quantity', args=[line.pk])
+            return lambda: client.post(url, {'quantity': rng.randint(1, 5)})
+        return lambda: client.get(reverse('shop:profile'))
+
+    def worker(self, scenario, user, product_ids, seed, requests, results):
+        rng = random.Random(seed)
+        samples = []
+        try:
+            send = self.prepare_client(scenario, user, product_ids, rng)
+            for _ in range(requests):
+                stats = QueryStats()
+                with ExitStack() as stack:
+                    for database in connections.all():
+                        stack.enter_context(database.execute_wrapper(stats))
+                    started = time.perf_counter()
+                    response = send()
+                    elapsed = time.perf_counter() - started
+                samples.append((elapsed, stats.count, response.status_code < 400))
+        finally:
+            results.extend(samples)
+            if threading.current_thread() is not threading.main_thread():
+                connection.close()
+
+    def run_scenario(self, scenario, users, product_ids, options):
+        workers, results = options['workers'], []
+        arguments = [
+            (scenario, users[index % len(users)], product_ids, options['seed'] * 1000 + index, options['requests'], results)
+            for index in range(workers)
+        ]
+        started = time.perf_counter()
+        if workers == 1:
+            self.worker(*arguments[0])
+        else:
+            threads = [threading.Thread(target=self.worker, args=args) for args in arguments]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        elapsed = time.perf_counter() - started
+
+        latencies = [sample[0] * 1000 for sample in results]
+        return {
+            'requests': len(results),
+            'errors': sum(1 for sample in results if not sample[2]),
+            'throughput_rps': round(len(results) / elapsed, 1),
+            'latency_ms': {
+                f'p{percent}': round(percentile(latencies, percent), 2) for percent in (50, 95, 99)
+            } if latencies else {},
+            'queries_per_request': round(sum(sample[1] for sample in results) / len(results), 2) if results else 0,
+        }
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        started_at = datetime.now(timezone.utc)
+        categories, users, product_ids = self.seed(options, rng)
+        try:
+            # Тестовый клиент ходит с Host: testserver
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                scenarios = {
+                    scenario: self.run_scenario(scenario, users, product_ids, options)
+                    for scenario in options['scenarios']
+                }
+        finally:
+            if not options['keep']:
+                self.cleanup(categories, users)
+
+        report = json.dumps({
+            'started_at': started_at.isoformat(),
+            'dataset': {
+                key: options[key] for key in ('categories', 'products', 'users', 'orders_per_user', 'cart_items', 'seed')
+            },
+            'workers': options['workers'],
+            'requests_per_worker': options['requests'],
+            'scenarios': scenarios,
+        }, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as target:
+                target.write(report + '\n')
+        else:
+            self.stdout.write(report)
@@ -0,0 +1,29 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.exports import EXPORTS, STREAMS, export_rows
+
+
+class Command(BaseCommand):
+    help = 'Потоковая выгрузка товаров, заказов и позиций заказов в CSV или JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=sorted(STREAMS), default='csv')
+        parser.add_argument('--from', dest='date_from', help='Начальная дата ГГГГ-ММ-ДД')
+        parser.add_argument('--to', dest='date_to', help='Конечная дата ГГГГ-ММ-ДД включительно')
+        parser.add_argument('--output', help='Файл; по умолчанию - стандартный вывод')
+
+    def handle(self, *args, **options):
+        try:
+            columns, rows = export_rows(options['kind'], options['date_from'], options['date_to'])
+        except (TypeError, ValueError):
+            raise CommandError('Даты указываются в формате ГГГГ-ММ-ДД')
+        target = open(options['output'], 'w', encoding='utf-8', newline='') if options['output'] else sys.stdout
+        try:
+            for chunk in STREAMS[options['format']](columns, rows):
+                target.write(chunk)
+        finally:
+            if target is not sys.stdout:
+                target.close()
@@ -0,0 +1,39 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from shop.images import render_variants
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Создаёт уменьшенные копии фото для существующих товаров в нескольких процессах'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='По умолчанию - число ядер')
+        parser.add_argument('--all', action='store_true', help='Обработать и товары, у которых копии уже есть')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').exclude(image__isnull=True)
+        if not options['all']:
+            products = products.filter(image_variants={})
+        jobs = list(products.values_list('pk', 'image'))
+        # Дочерние процессы не должны наследовать открытые соединения с БД
+        connections.close_all()
+
+        done, updated = 0, []
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {executor.submit(render_variants, pk, image): pk for pk, image in jobs}
+            for future in as_completed(futures):
+                pk = futures[future]
+                try:
+                    updated.append(Product(pk=pk, image_variants=future.result()))
+                except Exception as e:
+                    self.stderr.write(f'Товар {pk}: {e}')
+                done += 1
+                if done % 100 == 0:
+                    self.stdout.write(f'Обработано {done} из {len(jobs)}')
+
+        Product.objects.bulk_update(updated, ['image_variants'], batch_size=500)
+        self.stdout.write(self.style.SUCCESS(f'Созданы копии фото для {len(updated)} товаров'))
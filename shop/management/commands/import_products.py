@@ -0,0 +1,120 @@
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from cart.models import CartItem
+from shop.models import Category, Product
+from shop.navigation import invalidate_category_tree
+from shop.search import rebuild_index
+
+UPDATE_FIELDS = ['description', 'price', 'stock_quantity']
+
+
+class Command(BaseCommand):
+    help = ('Потоково импортирует товары из CSV или JSONL. Товар определяется парой '
+            '(name, category); существующие товары обновляются')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='По умолчанию - по расширению файла')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--no-reindex', action='store_true',
+                            help='Не перестраивать поисковый индекс после импорта')
+
+    def read_rows(self, path, file_format):
+        with open(path, encoding='utf-8', newline='') as source:
+            if file_format == 'csv':
+                yield from csv.DictReader(source)
+            else:
+                for line in source:
+                    if line.strip():
+                        yield json.loads(line)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+        chunk_size = options['chunk_size']
+        # Категории целиком в памяти: имя -> id. Их на порядки меньше, чем товаров
+        self.categories = dict(Category.objects.values_list('name', 'pk'))
+
+        started = time.monotonic()
+        imported = skipped = 0
+        chunk = {}
+        try:
+            for row in self.read_rows(path, file_format):
+                product = self.build_product(row)
+                if product is None:
+                    skipped += 1
+                    continue
+                # Повтор товара внутри пачки - берём последнюю строку
+                chunk[(product.name, product.category_id)] = product
+                if len(chunk) >= chunk_size:
+                    imported += self.flush(chunk)
+                    self.report(imported, started)
+            imported += self.flush(chunk)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Ошибка чтения {path}: {e}')
+
+        # bulk_create не отправляет сигналы - обновляем производные данные разом
+        invalidate_category_tree()
+        if not options['no_reindex']:
+            rebuild_index()
+        self.report(imported, started)
+        self.stdout.write(self.style.SUCCESS(f'Импортировано: {imported}, пропущено строк: {skipped}'))
+
+    def build_product(self, row):
+        try:
+            name = row['name'].strip()
+            category_name = row['category'].strip()
+            price = Decimal(str(row['price']))
+            stock_quantity = int(row.get('stock_quantity') or 0)
+        except (KeyError, AttributeError, InvalidOperation, ValueError):
+            return None
+        if not name or not category_name or stock_quantity < 0:
+            return None
+        return Product(
+            name=name,
+            category_id=self.category_id(category_name),
+            description=row.get('description') or '',
+            price=price,
+            stock_quantity=stock_quantity,
+        )
+
+    def category_id(self, name):
+        if name not in self.categories:
+            self.categories[name] = Category.objects.create(name=name, description='').pk
+        return self.categories[name]
+
+    def flush(self, chunk):
+        if not chunk:
+            return 0
+        with transaction.atomic():
+            Product.objects.bulk_create(
+                chunk.values(),
+                update_conflicts=True,
+                unique_fields=['name', 'category'],
+                update_fields=UPDATE_FIELDS,
+            )
+            self.subtract_reserved([product.pk for product in chunk.values()])
+        count = len(chunk)
+        chunk.clear()
+        return count
+
+    def subtract_reserved(self, product_ids):
+        """Фид несёт весь остаток склада, а stock_quantity хранится за вычетом резервов корзин"""
+        reserved = CartItem.objects.filter(item=OuterRef('pk')).order_by().values('item').annotate(
+            quantity=Sum('product_quantity')
+        ).values('quantity')
+        Product.objects.filter(pk__in=product_ids, cartitem__isnull=False).update(
+            stock_quantity=Greatest(F('stock_quantity') - Coalesce(Subquery(reserved), Value(0)), Value(0))
+        )
+
+    def report(self, imported, started):
+        elapsed = time.monotonic() - started
+        self.stdout.write(f'Импортировано {imported} строк, {imported / elapsed if elapsed else 0:.0f} строк/с')
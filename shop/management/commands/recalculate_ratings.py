@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает рейтинги товаров по отзывам одним запросом'
+
+    def handle(self, *args, **options):
+        updated = Product.objects.recalculate_ratings()
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано товаров: {updated}'))
@@ -0,0 +1,31 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from shop.routers import PRIMARY
+
+
+class Command(BaseCommand):
+    help = 'Копирует основную базу SQLite в файл реплики (локальная замена репликации)'
+
+    def handle(self, *args, **options):
+        replica = settings.DATABASE_REPLICA
+        if not replica:
+            raise CommandError('Реплика не настроена: задайте SQLITE_REPLICA_PATH')
+        primary_db, replica_db = connections[PRIMARY], connections[replica]
+        if primary_db.vendor != 'sqlite' or replica_db.vendor != 'sqlite':
+            raise CommandError('Команда работает только с SQLite, настоящая реплика синхронизируется сервером')
+        if primary_db.settings_dict['NAME'] == replica_db.settings_dict['NAME']:
+            raise CommandError('Реплика и основная база указывают на один файл')
+
+        replica_db.close()
+        primary_db.ensure_connection()
+        target = sqlite3.connect(replica_db.settings_dict['NAME'])
+        try:
+            # Онлайн-копия: запись в основную базу во время копирования не блокируется надолго
+            primary_db.connection.backup(target)
+        finally:
+            target.close()
+        self.stdout.write(self.style.SUCCESS(f'Реплика {replica_db.settings_dict["NAME"]} обновлена'))
@@ -0,0 +1,103 @@
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .routers import routing
+
+logger = logging.getLogger('shop.sql')
+
+
+class ReplicaPinMiddleware:
+    """Чтение своих записей: после записи клиент на REPLICA_PIN_SECONDS
+    закрепляется за основной базой, пока реплика догоняет изменения.
+
+    Должен стоять в начале MIDDLEWARE, чтобы запись сессии тоже учитывалась.
+    """
+    COOKIE = 'pin_primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with routing(pinned=self.COOKIE in request.COOKIES) as state:
+            response = self.get_response(request)
+        if state.written:
+            response.set_cookie(self.COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+        return response
+
+
+_IN_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+_NUMBER = re.compile(r'\b\d+\b')
+
+
+def statement_shape(sql):
+    """Форма запроса без значений: запросы, отличающиеся только параметрами, совпадают"""
+    return _NUMBER.sub('N', _IN_LIST.sub('(...)', sql))
+
+
+class QueryStats:
+    """execute_wrapper, собирающий число запросов, время в БД и повторы форм запросов"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.shapes[statement_shape(sql)] += 1
+
+    def repeated(self, more_than=1):
+        return {shape: count for shape, count in self.shapes.items() if count > more_than}
+
+
+class QueryInstrumentationMiddleware:
+    """Замер SQL каждого запроса: заголовок Server-Timing и строка лога в JSON.
+
+    Включается настройкой SQL_INSTRUMENTATION; выключенный middleware
+    исключается из цепочки при старте и ничего не стоит. Форма запроса,
+    повторённая больше SQL_N_PLUS_ONE_THRESHOLD раз, считается признаком N+1.
+    Запросы потокового ответа после выхода из view не учитываются.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'SQL_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.threshold = settings.SQL_N_PLUS_ONE_THRESHOLD
+
+    def __call__(self, request):
+        stats = QueryStats()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+
+        duration_ms = stats.duration * 1000
+        suspects = stats.repeated(self.threshold)
+        response.headers['Server-Timing'] = ', '.join(filter(None, [
+            response.headers.get('Server-Timing'),
+            f'db;dur={duration_ms:.2f};desc="{stats.count} SQL"',
+        ]))
+        logger.log(logging.WARNING if suspects else logging.INFO, json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': stats.count,
+            'db_ms': round(duration_ms, 2),
+            'duplicates': stats.repeated(),
+            'n_plus_one': suspects,
+        }, ensure_ascii=False))
+        return response
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+# Полнотекстовый индекс товаров (SQLite FTS5). Обновляется сигналами (shop/signals.py):
+# триггеры мешали бы SQLite пересоздавать db_product при изменении схемы.
+# bulk_create и update() сигналов не отправляют - после них нужен rebuild_search_index.
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE product_search USING fts5(
+        name, description, category, tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    INSERT INTO product_search (rowid, name, description, category)
+    SELECT p.id, p.name, p.description, c.name
+    FROM db_product p JOIN db_category c ON c.id = p.category_id
+    """,
+]
+
+DROP_SQL = [
+    "DROP TABLE IF EXISTS product_search",
+]
+
+
+def run(statements):
+    def apply(apps, schema_editor):
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        for sql in statements:
+            schema_editor.execute(sql)
+
+    return apply
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0004_product_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(run(CREATE_SQL), run(DROP_SQL)),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:42
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, FloatField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_ratings(apps, schema_editor):
+    Product = apps.get_model("shop", "Product")
+    Feedback = apps.get_model("shop", "Feedback")
+    feedbacks = Feedback.objects.filter(item=OuterRef("pk")).order_by().values("item")
+    Product.objects.update(
+        rating_sum=Coalesce(
+            Subquery(feedbacks.annotate(v=Sum("Rating")).values("v")), 0
+        ),
+        rating_count=Coalesce(
+            Subquery(feedbacks.annotate(v=Count("pk")).values("v")), 0
+        ),
+        rating_avg=Coalesce(
+            Subquery(
+                feedbacks.annotate(v=Avg("Rating")).values("v"),
+                output_field=FloatField(),
+            ),
+            0.0,
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0006_category_path"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="rating_avg",
+            field=models.FloatField(
+                db_index=True, default=0, editable=False, verbose_name="Рейтинг"
+            ),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="Количество отзывов"
+            ),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_sum",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0009_product_image_variants"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="accountdeletion",
+            index=models.Index(
+                fields=["created_at"], name="account_deletion_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="feedback",
+            index=models.Index(
+                fields=["item", "-created_at"], name="feedback_item_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["owner", "-created_at"], name="order_owner_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(fields=["created_at"], name="order_created_idx"),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0010_hot_path_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="outboxemail",
+            name="claimed_by",
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AlterField(
+            model_name="outboxemail",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "ожидает отправки"),
+                    ("sending", "отправляется"),
+                    ("sent", "отправлено"),
+                    ("failed", "не отправлено"),
+                ],
+                default="pending",
+                max_length=10,
+            ),
+        ),
+    ]
@@ -1,7 +1,11 @@
 import os
-from django.db import models
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+from django.db.models.functions import Cast, Coalesce, Concat, Substr
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
+from django.utils import timezone
+from .images import delete_variants
 from django.utils.translation import gettext_lazy as _
 
 
@@ -25,6 +29,8 @@ class Category(models.Model):
         related_name='children',
         help_text='Необязательное поле. Родительская категория.',
     )
+    # Материализованный путь вида "1/5/12/": id всех предков и самой категории
+    path = models.CharField(max_length=255, db_index=True, editable=False, default='')
 
     class Meta:
         ordering = ['name']
@@ -35,6 +41,141 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Сохранённое название, чтобы переиндексировать товары только при его смене
+        instance._saved_name = instance.__dict__.get('name')
+        return instance
+
+    @staticmethod
+    def subtree_range(path):
+        """Границы поддерева для фильтра по индексу: все пути, начинающиеся с path.
+
+        Путь оканчивается на "/", а следующий за ним символ в ASCII - "0".
+        """
+        return path, path[:-1] + '0'
+
+    def _build_path(self):
+        parent_path = self.parent.path if self.parent_id else ''
+        return f'{parent_path}{self.pk}/'
+
+    @transaction.atomic
+    def save(self, *args, **kwargs):
+        if self.parent_id and self.pk and f'/{self.pk}/' in f'/{self.parent.path}':
+            raise ValueError('Категория не может быть вложена в собственную подкатегорию')
+
+        super().save(*args, **kwargs)
+
+        old_path, new_path = self.path, self._build_path()
+        if old_path == new_path:
+            return
+        if old_path:
+            # Перенос: переписываем пути всего поддерева одним запросом
+            start, end = self.subtree_range(old_path)
+            Category.objects.filter(path__gte=start, path__lt=end).update(
+                path=Concat(models.Value(new_path), Substr('path', len(old_path) + 1))
+            )
+        else:
+            Category.objects.filter(pk=self.pk).update(path=new_path)
+        self.path = new_path
+
+    def get_descendants(self, include_self=False):
+        start, end = self.subtree_range(self.path)
+        descendants = Category.objects.filter(path__gte=start, path__lt=end)
+        return descendants if include_self else descendants.exclude(pk=self.pk)
+
+    def get_ancestors(self, include_self=False):
+        ids = [int(pk) for pk in self.path.split('/') if pk]
+        if not include_self:
+            ids = ids[:-1]
+        categories = Category.objects.in_bulk(ids)
+        return [categories[pk] for pk in ids if pk in categories]
+
+    def get_breadcrumbs(self):
+        """Цепочка от корня до текущей категории одним запросом"""
+        return self.get_ancestors(include_self=True)
+
+
+class OutOfStockError(ValueError):
+    pass
+
+
+class ProductManager(models.Manager):
+    """Резервирование остатков условным UPDATE без блокировки таблицы"""
+
+    @staticmethod
+    def _amounts(lines):
+        return models.Case(
+            *[models.When(pk=pk, then=models.Value(quantity)) for pk, quantity in lines.items()],
+            output_field=models.PositiveIntegerField(),
+        )
+
+    def in_category(self, category):
+        """Товары категории и всех её подкатегорий одним диапазонным фильтром"""
+        start, end = Category.subtree_range(category.path)
+        return self.filter(category__path__gte=start, category__path__lt=end)
+
+    def shift_rating(self, product_id, rating, count):
+        """Атомарно добавляет к агрегатам отзывов сумму оценок rating и их количество count"""
+        if not rating and not count:
+            return
+        new_sum = models.F('rating_sum') + rating
+        new_count = models.F('rating_count') + count
+        self.filter(pk=product_id).update(
+            rating_sum=new_sum,
+            rating_count=new_count,
+            rating_avg=models.Case(
+                models.When(rating_count=-count, then=models.Value(0.0)),
+                default=Cast(new_sum, models.FloatField()) / new_count,
+                output_field=models.FloatField(),
+            ),
+        )
+
+    def recalculate_ratings(self, product_ids=None):
+        """Пересчитывает агрегаты отзывов товаров (по умолчанию всех) одним запросом"""
+        feedbacks = Feedback.objects.filter(item=models.OuterRef('pk')).order_by().values('item')
+        rating_sum = feedbacks.annotate(value=models.Sum('Rating')).values('value')
+        rating_count = feedbacks.annotate(value=models.Count('pk')).values('value')
+        rating_avg = feedbacks.annotate(value=models.Avg('Rating')).values('value')
+        products = self.all() if product_ids is None else self.filter(pk__in=product_ids)
+        return products.update(
+            rating_sum=Coalesce(models.Subquery(rating_sum), 0),
+            rating_count=Coalesce(models.Subquery(rating_count), 0),
+            rating_avg=Coalesce(models.Subquery(rating_avg, output_field=models.FloatField()), 0.0),
+        )
+
+    def reserve(self, product_id, quantity):
+        if quantity <= 0:
+            return
+        updated = self.filter(pk=product_id, stock_quantity__gte=quantity).update(
+            stock_quantity=models.F('stock_quantity') - quantity
+        )
+        if not updated:
+            raise OutOfStockError('Недостаточно товара на складе')
+
+    def release(self, product_id, quantity):
+        if quantity > 0:
+            self.filter(pk=product_id).update(stock_quantity=models.F('stock_quantity') + quantity)
+
+    def reserve_many(self, lines):
+        """Резервирует все позиции {product_id: quantity} одним запросом либо ни одной"""
+        lines = {pk: quantity for pk, quantity in lines.items() if quantity > 0}
+        if not lines:
+            return
+        amounts = self._amounts(lines)
+        with transaction.atomic(using=self.db):
+            updated = self.filter(pk__in=lines, stock_quantity__gte=amounts).update(
+                stock_quantity=models.F('stock_quantity') - amounts
+            )
+            if updated != len(lines):
+                raise OutOfStockError('Недостаточно товара на складе')
+
+    def release_many(self, lines):
+        lines = {pk: quantity for pk, quantity in lines.items() if quantity > 0}
+        if lines:
+            self.filter(pk__in=lines).update(stock_quantity=models.F('stock_quantity') + self._amounts(lines))
+
 
 class Product(models.Model):
     name = models.CharField(max_length=100, null=False, verbose_name='Товар')
@@ -53,6 +194,14 @@ class Product(models.Model):
         verbose_name="Фото товара"
     )
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    # Агрегаты отзывов, поддерживаются при изменении Feedback
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество отзывов')
+    rating_avg = models.FloatField(default=0, db_index=True, editable=False, verbose_name='Рейтинг')
+    # Уменьшенные копии фото: {'thumb': {'webp': путь, 'jpeg': путь}, ...}
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    objects = ProductManager()
 
     class Meta:
         ordering = ['-created_at']
@@ -60,14 +209,35 @@ class Product(models.Model):
         verbose_name_plural = 'Товары'
         unique_together = ['name', 'category']
         db_table = 'db_product'
+        indexes = [
+            # Постраничный вывод каталога по курсору
+            models.Index(fields=['-created_at', '-id'], name='product_created_idx'),
+            models.Index(fields=['category', '-created_at', '-id'], name='product_category_created_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Имя сохранённого фото, чтобы пересоздавать копии только при его замене
+        instance._saved_image = instance.__dict__.get('image')
+        return instance
+
+    @property
+    def image_variant_urls(self):
+        return {
+            name: {extension: default_storage.url(path) for extension, path in formats.items()}
+            for name, formats in self.image_variants.items()
+        }
+
     def delete(self, *args, **kwargs):
 
+        if self.image_variants:
+            delete_variants(self.image_variants)
         if self.image:
-            self.image.delete()
+            self.image.delete(save=False)
         super().delete(*args, **kwargs)
 
 
@@ -126,12 +296,15 @@ class Order(models.Model):
         default="в обработке")
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)  # Сначала сохраняем заказ
-        self._calculate_total()        # Затем пересчитываем сумму
+        # У нового заказа ещё нет позиций - сумму передают при создании
+        if not self._state.adding:
+            self.total = self._calculate_total()
+        super().save(*args, **kwargs)
 
     def _calculate_total(self):
-        self.total = sum(item.item_price for item in self.items.all())
-        super().save(update_fields=['total'])
+        """Сумма позиций заказа одним агрегатным запросом"""
+        total = self.items.aggregate(total=models.Sum(models.F('item__price') * models.F('product_quantity')))['total']
+        return total or 0
 
     def __str__(self):
         return f"Заказ {self.owner.email} - {self.total} руб."
@@ -141,6 +314,11 @@ class Order(models.Model):
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
         db_table = 'db_order'
+        indexes = [
+            # История заказов в профиле и выгрузка по диапазону дат
+            models.Index(fields=['owner', '-created_at'], name='order_owner_created_idx'),
+            models.Index(fields=['created_at'], name='order_created_idx'),
+        ]
 
 
 class OrderItem(models.Model):
@@ -171,6 +349,13 @@ class Feedback(models.Model):
         default=5)
     feedback = models.TextField()
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Сохранённые товар и оценка нужны для пересчёта рейтинга товара
+        instance._saved_rating = (instance.item_id, instance.Rating)
+        return instance
+
     def __str__(self):
         return f"{self.feedback} "
 
@@ -178,6 +363,7 @@ class Feedback(models.Model):
         verbose_name = 'Отзыв'
         verbose_name_plural = 'Отзывы'
         db_table = 'db_feedback'
+        indexes = [models.Index(fields=['item', '-created_at'], name='feedback_item_created_idx')]
 
 
 class AccountDeletion(models.Model):
@@ -187,4 +373,38 @@ class AccountDeletion(models.Model):
 
     class Meta:
         db_table = 'account_deletions'
+        indexes = [models.Index(fields=['created_at'], name='account_deletion_created_idx')]
+
+
+class OutboxEmail(models.Model):
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    recipients = models.TextField(help_text='Адреса через запятую')
+    status = models.CharField(
+        max_length=10,
+        choices=[(PENDING, 'ожидает отправки'), (SENDING, 'отправляется'), (SENT, 'отправлено'),
+                 (FAILED, 'не отправлено')],
+        default=PENDING,
+    )
+    # Метка обработчика, взявшего письмо; пока идёт отправка, next_attempt_at - срок аренды
+    claimed_by = models.CharField(max_length=32, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        verbose_name = 'Письмо'
+        verbose_name_plural = 'Очередь писем'
+        db_table = 'db_outbox_email'
+        indexes = [models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx')]
+
+    def __str__(self):
+        return f"{self.subject} -> {self.recipients}"
@@ -0,0 +1,57 @@
+from django.core.cache import cache
+from django.db.models import Count
+
+from .models import Category
+
+VERSION_KEY = 'category_tree:version'
+
+# Копия дерева в памяти процесса; актуальность проверяется по версии в общем кэше
+_local = {'version': None, 'tree': None}
+
+
+def build_category_tree():
+    """Строит дерево категорий одним запросом.
+
+    Узел: {'id', 'name', 'product_count', 'children'}, где product_count
+    учитывает товары всех подкатегорий.
+    """
+    rows = Category.objects.order_by('path').annotate(own_count=Count('product')).values_list(
+        'id', 'name', 'parent_id', 'own_count'
+    )
+    nodes, roots = {}, []
+    for pk, name, parent_id, own_count in rows:
+        node = nodes[pk] = {'id': pk, 'name': name, 'product_count': own_count, 'children': []}
+        parent = nodes.get(parent_id)
+        (parent['children'] if parent else roots).append(node)
+
+    def count(node):
+        node['product_count'] += sum(count(child) for child in node['children'])
+        node['children'].sort(key=lambda child: child['name'])
+        return node['product_count']
+
+    for root in roots:
+        count(root)
+    roots.sort(key=lambda node: node['name'])
+    return roots
+
+
+def get_category_tree():
+    version = cache.get_or_set(VERSION_KEY, 1, None)
+    if _local['version'] == version:
+        return _local['tree']
+
+    key = f'category_tree:{version}'
+    tree = cache.get(key)
+    if tree is None:
+        tree = build_category_tree()
+        cache.set(key, tree, None)
+    _local.update(version=version, tree=tree)
+    return tree
+
+
+def invalidate_category_tree():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+    _local.update(version=None, tree=None)
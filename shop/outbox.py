@@ -0,0 +1,95 @@
+import uuid
+from contextlib import suppress
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import models
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+
+def queue_mail(subject, message, from_email, recipient_list):
+    """Ставит письмо в очередь вместо отправки в потоке запроса"""
+    return OutboxEmail.objects.create(
+        subject=subject,
+        body=message,
+        from_email=from_email,
+        recipients=','.join(recipient_list),
+    )
+
+
+def claim_due(batch_size, now):
+    """Забирает пачку писем к отправке условным UPDATE.
+
+    Письмо получает метку обработчика и срок аренды, поэтому два обработчика
+    не отправят его дважды, а письмо упавшего обработчика вернётся в очередь
+    по истечении OUTBOX_CLAIM_TIMEOUT.
+    """
+    due = (
+        models.Q(status=OutboxEmail.PENDING) | models.Q(status=OutboxEmail.SENDING)
+    ) & models.Q(next_attempt_at__lte=now)
+    token = uuid.uuid4().hex
+    candidates = OutboxEmail.objects.filter(due).order_by('next_attempt_at').values_list('pk', flat=True)[:batch_size]
+    OutboxEmail.objects.filter(due, pk__in=list(candidates)).update(
+        status=OutboxEmail.SENDING,
+        claimed_by=token,
+        next_attempt_at=now + timedelta(seconds=settings.OUTBOX_CLAIM_TIMEOUT),
+    )
+    return list(OutboxEmail.objects.filter(status=OutboxEmail.SENDING, claimed_by=token))
+
+
+def schedule_retry(email, error, now):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        email.status = OutboxEmail.FAILED
+    else:
+        email.status = OutboxEmail.PENDING
+        delay = settings.OUTBOX_RETRY_DELAY * 2 ** (email.attempts - 1)
+        email.next_attempt_at = now + timedelta(seconds=delay)
+
+
+def send_pending(batch_size=100):
+    """Отправляет пачку писем через одно SMTP-соединение.
+
+    Неудачные попытки, в том числе недоступный SMTP-сервер, повторяются
+    с экспоненциальной задержкой, после OUTBOX_MAX_ATTEMPTS письмо
+    помечается как неотправленное.
+    Возвращает количество отправленных и неудачных писем.
+    """
+    now = timezone.now()
+    emails = claim_due(batch_size, now)
+    if not emails:
+        return 0, 0
+
+    sent, failed = [], []
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        # Сервер недоступен - вся пачка откладывается
+        for email in emails:
+            schedule_retry(email, e, now)
+        failed = emails
+    else:
+        try:
+            for email in emails:
+                message = EmailMessage(email.subject, email.body, email.from_email,
+                                       email.recipients.split(','), connection=connection)
+                try:
+                    message.send()
+                except Exception as e:
+                    schedule_retry(email, e, now)
+                    failed.append(email)
+                else:
+                    sent.append(email.pk)
+        finally:
+            # Письма уже отправлены, ошибка при закрытии соединения на них не влияет
+            with suppress(Exception):
+                connection.close()
+
+    OutboxEmail.objects.filter(pk__in=sent).update(status=OutboxEmail.SENT, sent_at=timezone.now())
+    OutboxEmail.objects.bulk_update(failed, ['attempts', 'last_error', 'status', 'next_attempt_at'])
+    return len(sent), len(failed)
@@ -0,0 +1,97 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+
+PRIMARY = 'default'
+
+# Состояние маршрутизации текущего запроса
+_routing = ContextVar('db_routing', default=None)
+
+
+class RoutingState:
+    def __init__(self, pinned=False):
+        # Чтения разрешено отправлять на реплику (только внутри read_from_replica)
+        self.use_replica = False
+        # После записи все чтения запроса идут на основную базу
+        self.pinned = pinned
+        self.written = False
+
+
+def current_state():
+    return _routing.get()
+
+
+@contextmanager
+def routing(pinned=False):
+    """Область одного запроса: запись в ней закрепляет чтения за основной базой"""
+    state = _routing.get()
+    if state is not None:
+        yield state
+        return
+    state = RoutingState(pinned)
+    token = _routing.set(state)
+    try:
+        yield state
+    finally:
+        _routing.reset(token)
+
+
+@contextmanager
+def replica_reads():
+    """Разрешает чтение с реплики, пока в запросе не было записи"""
+    with routing() as state:
+        previous = state.use_replica
+        state.use_replica = True
+        try:
+            yield state
+        finally:
+            state.use_replica = previous
+
+
+def _replica_stream(content, pinned):
+    with routing(pinned), replica_reads():
+        yield from content
+
+
+def read_from_replica(view):
+    """Декоратор view, которое только читает данные: чтения уходят на реплику.
+
+    Потоковый ответ читает базу уже после выхода из view, поэтому его
+    содержимое тоже оборачивается.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with replica_reads() as state:
+            response = view(request, *args, **kwargs)
+        if response.streaming:
+            response.streaming_content = _replica_stream(response.streaming_content, state.pinned)
+        return response
+    return wrapper
+
+
+class PrimaryReplicaRouter:
+    """Запись - всегда в основную базу, чтение - на реплику settings.DATABASE_REPLICA,
+    если view разрешило это через read_from_replica и запрос ещё ничего не записал.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _routing.get()
+        replica = getattr(settings, 'DATABASE_REPLICA', None)
+        if replica and state is not None and state.use_replica and not state.pinned:
+            return replica
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        state = _routing.get()
+        if state is not None:
+            state.pinned = state.written = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика содержит те же данные, что и основная база
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
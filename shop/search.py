@@ -0,0 +1,87 @@
+from django.db import connection, connections, router
+
+from .models import Product
+
+
+def build_match_query(query):
+    """Превращает пользовательский ввод в безопасный запрос FTS5 с поиском по префиксу"""
+    terms = [term.replace('"', '""') for term in query.split()]
+    return ' '.join(f'"{term}"*' for term in terms if term)
+
+
+def search_products(query, limit=20):
+    """Товары, упорядоченные по релевантности (bm25)"""
+    match = build_match_query(query)
+    if not match:
+        return []
+
+    # Поиск только читает - индекс берётся из той же базы, что и товары
+    database = connections[router.db_for_read(Product)]
+    if database.vendor != 'sqlite':
+        return list(Product.objects.select_related('category').filter(name__icontains=query)[:limit])
+
+    with database.cursor() as cursor:
+        cursor.execute(
+            'SELECT rowid FROM product_search WHERE product_search MATCH %s '
+            'ORDER BY bm25(product_search, 10.0, 1.0, 5.0) LIMIT %s',
+            [match, limit],
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+
+    products = Product.objects.select_related('category').in_bulk(ids)
+    return [products[pk] for pk in ids if pk in products]
+
+
+def index_products(products):
+    """Добавляет или обновляет товары в индексе"""
+    if connection.vendor != 'sqlite':
+        return
+    rows = [(product.pk, product.name, product.description, product.category_id) for product in products]
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM product_search WHERE rowid IN ({", ".join(["%s"] * len(rows))})',
+            [row[0] for row in rows],
+        )
+        cursor.executemany(
+            'INSERT INTO product_search (rowid, name, description, category) '
+            'VALUES (%s, %s, %s, (SELECT name FROM db_category WHERE id = %s))',
+            rows,
+        )
+
+
+def remove_product(product_id):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM product_search WHERE rowid = %s', [product_id])
+
+
+def reindex_category(category):
+    """Обновляет название категории у всех её товаров одним запросом"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'UPDATE product_search SET category = %s '
+            'WHERE rowid IN (SELECT id FROM db_product WHERE category_id = %s)',
+            [category.name, category.pk],
+        )
+
+
+def rebuild_index():
+    """Полностью перестраивает индекс: очистка, одна вставка всех товаров и слияние сегментов.
+
+    Возвращает число проиндексированных товаров.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM product_search')
+        cursor.execute(
+            'INSERT INTO product_search (rowid, name, description, category) '
+            'SELECT p.id, p.name, p.description, c.name '
+            'FROM db_product p JOIN db_category c ON c.id = p.category_id'
+        )
+        cursor.execute("INSERT INTO product_search (product_search) VALUES ('optimize')")
+        cursor.execute('SELECT count(*) FROM product_search')
+        return cursor.fetchone()[0]
@@ -0,0 +1,70 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .images import delete_variants, render_variants
+from .models import Category, Feedback, Product
+from .navigation import invalidate_category_tree
+from .search import index_products, reindex_category, remove_product
+
+
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance, **kwargs):
+    index_products([instance])
+
+
+@receiver(post_delete, sender=Product)
+def remove_deleted_product(sender, instance, **kwargs):
+    remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def reindex_saved_category(sender, instance, created, **kwargs):
+    # Из категории в индексе только название - остальные изменения его не касаются
+    if not created and instance.name != getattr(instance, '_saved_name', None):
+        reindex_category(instance)
+    instance._saved_name = instance.name
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def reset_category_tree(sender, using, **kwargs):
+    # Новая версия публикуется после фиксации: иначе параллельный запрос успеет
+    # построить дерево по старым данным и закэшировать его под новой версией
+    transaction.on_commit(invalidate_category_tree, using=using)
+
+
+@receiver(post_save, sender=Feedback)
+def update_rating_on_save(sender, instance, created, **kwargs):
+    previous = None if created else getattr(instance, '_saved_rating', None)
+    if previous is None and not created:
+        Product.objects.recalculate_ratings([instance.item_id])
+    elif previous and previous[0] == instance.item_id:
+        Product.objects.shift_rating(instance.item_id, instance.Rating - previous[1], 0)
+    else:
+        if previous:
+            Product.objects.shift_rating(previous[0], -previous[1], -1)
+        Product.objects.shift_rating(instance.item_id, instance.Rating, 1)
+    instance._saved_rating = (instance.item_id, instance.Rating)
+
+
+@receiver(post_delete, sender=Feedback)
+def update_rating_on_delete(sender, instance, **kwargs):
+    item_id, rating = getattr(instance, '_saved_rating', (instance.item_id, instance.Rating))
+    Product.objects.shift_rating(item_id, -rating, -1)
+
+
+@receiver(post_save, sender=Product)
+def generate_image_variants(sender, instance, created, **kwargs):
+    image_name = instance.image.name if instance.image else ''
+    if (image_name or '') == (getattr(instance, '_saved_image', None) or ''):
+        return
+    old_variants = instance.image_variants
+    instance.image_variants = render_variants(instance.pk, image_name) if image_name else {}
+    # update() не отправляет post_save и не вызывает этот обработчик повторно
+    Product.objects.filter(pk=instance.pk).update(image_variants=instance.image_variants)
+    instance._saved_image = image_name
+    if old_variants and old_variants != instance.image_variants:
+        delete_variants(old_variants)
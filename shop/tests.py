@@ -1,3 +1,695 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.base_user import AbstractBaseUser
+from django.core import mail
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, router
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from cart.models import Cart, CartItem
+from .models import AccountDeletion, Category, CustomUser, Feedback, Order, OrderItem, OutboxEmail, Product
+from .admin import EstimatedCountPaginator
+from .exports import export_rows
+from .management.commands.benchmark_views import percentile
+from .forms import CustomUserLoginForm
+from . import navigation
+from .navigation import get_category_tree, invalidate_category_tree
+from .middleware import QueryInstrumentationMiddleware, ReplicaPinMiddleware
+from .outbox import claim_due, queue_mail, send_pending
+from .routers import read_from_replica, replica_reads
+from .search import rebuild_index, search_products
+from .utils import after_cursor, encode_cursor, full_scans
+
+
+@override_settings(CATALOG_PAGE_SIZE=3)
+class CatalogTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = Category.objects.create(name='Книги', description='')
+        cls.pens = Category.objects.create(name='Ручки', description='')
+        for index in range(7):
+            Product.objects.create(name=f'Книга {index}', description='', price=10, category=cls.books)
+            Product.objects.create(name=f'Ручка {index}', description='', price=5, category=cls.pens)
+
+    def walk(self, **params):
+        seen, cursor = [], None
+        while True:
+            if cursor:
+                params['cursor'] = cursor
+            response = self.client.get(reverse('shop:catalog'), params)
+            seen.extend(product.pk for product in response.context['products'])
+            cursor = response.context['next_cursor']
+            if not cursor:
+                return seen
+
+    def test_pages_cover_catalog_without_duplicates(self):
+        seen = self.walk()
+        self.assertEqual(len(seen), 14)
+        self.assertEqual(seen, list(Product.objects.order_by('-created_at', '-id').values_list('pk', flat=True)))
+
+    def test_category_filter(self):
+        seen = self.walk(category=self.pens.pk)
+        self.assertEqual(set(seen), set(self.pens.product_set.values_list('pk', flat=True)))
+
+    def test_deep_page_costs_the_same_as_first(self):
+        url = reverse('shop:catalog')
+        self.client.get(url)  # Создаём сессию заранее
+        with CaptureQueriesContext(connection) as first_queries:
+            response = self.client.get(url)
+        with CaptureQueriesContext(connection) as deep_queries:
+            self.client.get(url, {'cursor': response.context['next_cursor']})
+        self.assertEqual(len(first_queries), len(deep_queries))
+        self.assertNotIn('OFFSET', deep_queries[0]['sql'])
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = Category.objects.create(name='Книги', description='')
+        cls.novel = Product.objects.create(name='Роман', description='Толстая книга о войне', price=10, category=cls.books)
+        cls.pen = Product.objects.create(
+            name='Ручка', description='Синяя', price=5, category=Category.objects.create(name='Канцелярия', description='')
+        )
+
+    def test_ranked_search_over_name_description_and_category(self):
+        self.assertEqual(search_products('ром'), [self.novel])
+        self.assertEqual(search_products('войне'), [self.novel])
+        self.assertEqual(search_products('канцелярия'), [self.pen])
+        self.assertEqual(search_products('"; DROP'), [])
+
+    def test_index_follows_changes(self):
+        self.pen.name = 'Карандаш'
+        self.pen.save()
+        self.assertEqual(search_products('карандаш'), [self.pen])
+
+        self.books.name = 'Литература'
+        self.books.save()
+        self.assertEqual(search_products('литература'), [self.novel])
+
+        self.novel.delete()
+        self.assertEqual(search_products('роман'), [])
+
+    def test_category_reindexed_only_on_rename(self):
+        category = Category.objects.get(pk=self.books.pk)
+        category.description = 'Новое описание'
+        with mock.patch('shop.signals.reindex_category') as reindex:
+            category.save()
+            category.name = 'Литература'
+            category.save()
+            category.save()
+        reindex.assert_called_once_with(category)
+
+    def test_rebuild_index(self):
+        self.assertEqual(rebuild_index(), 2)
+        self.assertEqual(search_products('синяя'), [self.pen])
+
+    def test_search_view(self):
+        response = self.client.get(reverse('shop:search'), {'q': 'роман'})
+        self.assertEqual(list(response.context['products']), [self.novel])
+
+
+class CategoryTreeTests(TestCase):
+    def setUp(self):
+        self.root = Category.objects.create(name='Товары', description='')
+        self.books = Category.objects.create(name='Книги', description='', parent=self.root)
+        self.novels = Category.objects.create(name='Романы', description='', parent=self.books)
+        self.pens = Category.objects.create(name='Ручки', description='', parent=self.root)
+
+    def test_paths(self):
+        self.assertEqual(self.novels.path, f'{self.root.pk}/{self.books.pk}/{self.novels.pk}/')
+
+    def test_descendants_and_breadcrumbs(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(set(self.root.get_descendants()), {self.books, self.novels, self.pens})
+        with self.assertNumQueries(1):
+            self.assertEqual(self.novels.get_breadcrumbs(), [self.root, self.books, self.novels])
+
+    def test_subtree_products(self):
+        novel = Product.objects.create(name='Роман', description='', price=10, category=self.novels)
+        Product.objects.create(name='Ручка', description='', price=5, category=self.pens)
+        with self.assertNumQueries(1):
+            self.assertEqual(list(Product.objects.in_category(self.books)), [novel])
+
+    def test_move_rewrites_subtree(self):
+        self.books.parent = self.pens
+        self.books.save()
+        self.novels.refresh_from_db()
+        self.assertEqual(self.novels.get_breadcrumbs(), [self.root, self.pens, self.books, self.novels])
+
+    def test_cannot_move_into_own_subtree(self):
+        self.books.parent = self.novels
+        with self.assertRaises(ValueError):
+            self.books.save()
+
+
+class CategoryNavigationTests(TestCase):
+    def setUp(self):
+        invalidate_category_tree()
+        self.root = Category.objects.create(name='Товары', description='')
+        self.books = Category.objects.create(name='Книги', description='', parent=self.root)
+        Product.objects.create(name='Роман', description='', price=10, category=self.books)
+        Product.objects.create(name='Коробка', description='', price=1, category=self.root)
+
+    def catalog_queries(self):
+        """Дерево и запросы к таблицам каталога; обращения к кэшу не учитываются"""
+        with CaptureQueriesContext(connection) as queries:
+            tree = get_category_tree()
+        return tree, [query for query in queries if 'db_category' in query['sql']]
+
+    def test_tree_with_subtree_counts(self):
+        tree, queries = self.catalog_queries()
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(tree[0]['name'], 'Товары')
+        self.assertEqual(tree[0]['product_count'], 2)
+        self.assertEqual(tree[0]['children'][0]['product_count'], 1)
+
+    def test_cached_until_catalog_changes(self):
+        get_category_tree()
+        self.assertEqual(self.catalog_queries()[1], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Ручки', description='', parent=self.root)
+            # До фиксации транзакции отдаётся прежнее дерево
+            self.assertEqual(self.catalog_queries()[1], [])
+        names = [node['name'] for node in get_category_tree()[0]['children']]
+        self.assertEqual(names, ['Книги', 'Ручки'])
+
+    def test_change_from_another_process_is_seen(self):
+        self.assertNotIn('locmem', settings.CACHES['default']['BACKEND'])
+        get_category_tree()
+        # Другой процесс (например, import_products) поднимает версию в общем кэше,
+        # а копия дерева в памяти этого процесса остаётся прежней
+        stale = dict(navigation._local)
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Ручки', description='', parent=self.root)
+        navigation._local.update(stale)
+
+        names = [node['name'] for node in get_category_tree()[0]['children']]
+        self.assertEqual(names, ['Книги', 'Ручки'])
+
+
+class RatingTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Книги', description='')
+        self.book = Product.objects.create(name='Роман', description='', price=10, category=category)
+        self.other = Product.objects.create(name='Повесть', description='', price=10, category=category)
+        self.user = CustomUser.objects.create_user('reader@example.com', 'password')
+
+    def assertRating(self, product, rating_sum, rating_count, rating_avg):
+        product.refresh_from_db()
+        self.assertEqual((product.rating_sum, product.rating_count), (rating_sum, rating_count))
+        self.assertAlmostEqual(product.rating_avg, rating_avg)
+
+    def test_aggregates_follow_feedback(self):
+        first = Feedback.objects.create(item=self.book, user=self.user, Rating=5, feedback='')
+        Feedback.objects.create(item=self.book, user=self.user, Rating=2, feedback='')
+        self.assertRating(self.book, 7, 2, 3.5)
+
+        first = Feedback.objects.get(pk=first.pk)
+        first.Rating = 4
+        first.save()
+        self.assertRating(self.book, 6, 2, 3.0)
+
+        first.item = self.other
+        first.save()
+        self.assertRating(self.book, 2, 1, 2.0)
+        self.assertRating(self.other, 4, 1, 4.0)
+
+        Feedback.objects.all().delete()
+        self.assertRating(self.book, 0, 0, 0)
+
+    def test_recalculate_ratings(self):
+        Feedback.objects.create(item=self.book, user=self.user, Rating=3, feedback='')
+        Product.objects.update(rating_sum=0, rating_count=0, rating_avg=0)
+        Product.objects.recalculate_ratings()
+        self.assertRating(self.book, 3, 1, 3.0)
+        self.assertRating(self.other, 0, 0, 0)
+
+
+@override_settings(ORDER_HISTORY_PAGE_SIZE=10)
+class ProfileQueryBudgetTests(TestCase):
+    # Сессия, пользователь, корзина, подсчёт заказов, заказы, позиции заказов
+    # и позиции корзины. Не зависит от истории заказов.
+    QUERY_BUDGET = 7
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('buyer@example.com', 'password', is_active=True)
+        self.category = Category.objects.create(name='Книги', description='')
+        self.client.force_login(self.user)
+        self.client.get(reverse('shop:profile'))  # Плановое продление сессии после входа
+
+    def add_orders(self, count, lines=5):
+        products = [
+            Product.objects.create(name=f'Товар {Product.objects.count()}', description='', price=10,
+                                   category=self.category, stock_quantity=100)
+            for _ in range(lines)
+        ]
+        for _ in range(count):
+            order = Order.objects.create(owner=self.user, total=50)
+            OrderItem.objects.bulk_create(OrderItem(order_item=order, item=product) for product in products)
+        cart = Cart.objects.get_or_create(user=self.user)[0]
+        for product in products:
+            CartItem.objects.get_or_create(cart_item=cart, item=product)
+
+    def profile_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('shop:profile'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_profile_stays_within_budget(self):
+        self.add_orders(50)
+        self.assertLessEqual(self.profile_queries(), self.QUERY_BUDGET)
+
+    def test_query_count_does_not_grow_with_history(self):
+        self.add_orders(1)
+        small = self.profile_queries()
+        self.add_orders(30)
+        self.assertEqual(self.profile_queries(), small)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', OUTBOX_RETRY_DELAY=60)
+class OutboxTests(TestCase):
+    def test_register_only_queues_mail(self):
+        response = self.client.post(reverse('shop:register'), {
+            'email': 'new@example.com', 'password1': 'Sl0zhnyi-parol', 'password2': 'Sl0zhnyi-parol',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboxEmail.objects.get().recipients, 'new@example.com')
+
+        self.assertEqual(send_pending(), (1, 0))
+        self.assertEqual(mail.outbox[0].to, ['new@example.com'])
+        self.assertEqual(OutboxEmail.objects.get().status, OutboxEmail.SENT)
+
+    def test_failed_send_is_retried_later(self):
+        email = queue_mail('Тема', 'Текст', 'admin@shop.com', ['a@example.com'])
+        with mock.patch('django.core.mail.EmailMessage.send', side_effect=OSError('SMTP недоступен')):
+            self.assertEqual(send_pending(), (0, 1))
+
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboxEmail.PENDING, 1))
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertEqual(send_pending(), (0, 0))
+
+    def test_unreachable_server_reschedules_batch(self):
+        email = queue_mail('Тема', 'Текст', 'admin@shop.com', ['a@example.com'])
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open',
+                        side_effect=ConnectionRefusedError('Connection refused'), create=True):
+            self.assertEqual(send_pending(), (0, 1))
+
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboxEmail.PENDING, 1))
+        self.assertGreater(email.next_attempt_at, timezone.now())
+
+    def test_claimed_email_is_not_taken_twice(self):
+        queue_mail('Тема', 'Текст', 'admin@shop.com', ['a@example.com'])
+        now = timezone.now()
+        self.assertEqual(len(claim_due(10, now)), 1)
+        self.assertEqual(claim_due(10, now), [])
+        self.assertEqual(send_pending(), (0, 0))
+        # Аренда упавшего обработчика истекла - письмо снова доступно
+        later = now + timedelta(seconds=settings.OUTBOX_CLAIM_TIMEOUT + 1)
+        self.assertEqual(len(claim_due(10, later)), 1)
+
+
+class LoginTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('user@example.com', 'password', is_active=True)
+
+    def test_login_hashes_password_once(self):
+        with mock.patch.object(CustomUser, 'check_password', autospec=True,
+                               side_effect=AbstractBaseUser.check_password) as check_password:
+            response = self.client.post(reverse('shop:login'), {'email': 'user@example.com', 'password': 'password'})
+        self.assertRedirects(response, reverse('shop:profile'), fetch_redirect_response=False)
+        self.assertEqual(check_password.call_count, 1)
+
+    def test_form_uses_single_user_query(self):
+        form = CustomUserLoginForm(None, data={'email': 'user@example.com', 'password': 'password'})
+        with self.assertNumQueries(1):
+            self.assertTrue(form.is_valid())
+        self.assertEqual(form.get_user(), self.user)
+
+    def test_error_messages(self):
+        cases = [
+            ({'email': 'user@example.com', 'password': 'wrong'}, 'Неверный пароль'),
+            ({'email': 'nobody@example.com', 'password': 'password'}, 'Пользователь с таким email не найден'),
+        ]
+        for data, error in cases:
+            form = CustomUserLoginForm(None, data=data)
+            self.assertFalse(form.is_valid())
+            self.assertIn(error, form.non_field_errors())
+
+        self.user.is_active = False
+        self.user.save()
+        form = CustomUserLoginForm(None, data={'email': 'user@example.com', 'password': 'password'})
+        self.assertFalse(form.is_valid())
+        self.assertIn('Аккаунт не активирован', form.non_field_errors()[0])
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings_override = override_settings(MEDIA_ROOT=media, PRODUCT_IMAGE_VARIANTS={'thumb': (50, 50)})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.category = Category.objects.create(name='Книги', description='')
+
+    def make_image(self, color):
+        buffer = BytesIO()
+        Image.new('RGBA', (400, 300), color).save(buffer, 'PNG')
+        return SimpleUploadedFile('photo.png', buffer.getvalue(), content_type='image/png')
+
+    def test_variants_created_on_upload_and_removed_on_delete(self):
+        product = Product.objects.create(name='Книга', description='', price=10, category=self.category,
+                                         image=self.make_image('red'))
+        paths = product.image_variants['thumb']
+        self.assertEqual(set(paths), {'webp', 'jpeg'})
+        with default_storage.open(paths['jpeg']) as variant:
+            self.assertEqual(Image.open(variant).size, (50, 38))
+        self.assertEqual(Product.objects.get(pk=product.pk).image_variants, product.image_variants)
+
+        product = Product.objects.get(pk=product.pk)
+        product.image = self.make_image('blue')
+        product.save()
+        self.assertNotEqual(product.image_variants['thumb']['webp'], paths['webp'])
+        self.assertFalse(default_storage.exists(paths['webp']))
+
+        new_paths = product.image_variants['thumb']
+        product.delete()
+        self.assertFalse(default_storage.exists(new_paths['jpeg']))
+
+    def test_unchanged_image_is_not_reprocessed(self):
+        product = Product.objects.create(name='Книга', description='', price=10, category=self.category,
+                                         image=self.make_image('red'))
+        product = Product.objects.get(pk=product.pk)
+        with mock.patch('shop.signals.render_variants') as render:
+            product.price = 20
+            product.save()
+        render.assert_not_called()
+
+
+class ImportProductsTests(TestCase):
+    def write(self, suffix, content):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w', encoding='utf-8') as target:
+            target.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_csv_import_upserts_on_name_and_category(self):
+        books = Category.objects.create(name='Книги', description='')
+        Product.objects.create(name='Роман', description='старое', price=1, category=books)
+        path = self.write('.csv', (
+            'name,category,price,description,stock_quantity\n'
+            'Роман,Книги,250.50,новое,7\n'
+            'Ручка,Канцелярия,15,,100\n'
+            'Роман,Канцелярия,99,,1\n'
+            'Без цены,Книги,,,1\n'
+        ))
+        call_command('import_products', path, chunk_size=2, stdout=StringIO())
+
+        self.assertEqual(Product.objects.count(), 3)
+        novel = Product.objects.get(name='Роман', category=books)
+        self.assertEqual((novel.price, novel.description, novel.stock_quantity), (Decimal('250.50'), 'новое', 7))
+        self.assertTrue(Category.objects.filter(name='Канцелярия').exists())
+        self.assertEqual([p.name for p in search_products('ручка')], ['Ручка'])
+
+    def test_jsonl_import(self):
+        path = self.write('.jsonl', '\n'.join(json.dumps(row, ensure_ascii=False) for row in [
+            {'name': 'Роман', 'category': 'Книги', 'price': '10', 'stock_quantity': 2},
+            {'name': 'Роман', 'category': 'Книги', 'price': '12', 'stock_quantity': 3},
+        ]))
+        call_command('import_products', path, stdout=StringIO())
+        self.assertEqual(Product.objects.get().price, 12)
+
+    def test_reimport_keeps_cart_reservations(self):
+        books = Category.objects.create(name='Книги', description='')
+        novel = Product.objects.create(name='Роман', description='', price=1, category=books, stock_quantity=10)
+        user = CustomUser.objects.create_user('reader@example.com', 'password')
+        Cart.objects.create(user=user).add(novel, 3)
+        path = self.write('.csv', 'name,category,price,stock_quantity\nРоман,Книги,5,20\nРучка,Книги,1,4\n')
+        call_command('import_products', path, stdout=StringIO())
+
+        novel.refresh_from_db()
+        self.assertEqual((novel.price, novel.stock_quantity), (5, 17))
+        self.assertEqual(Product.objects.get(name='Ручка').stock_quantity, 4)
+
+        path = self.write('.csv', 'name,category,price,stock_quantity\nРоман,Книги,5,2\n')
+        call_command('import_products', path, stdout=StringIO())
+        novel.refresh_from_db()
+        self.assertEqual(novel.stock_quantity, 0)
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = CustomUser.objects.create_user('staff@example.com', 'password', is_active=True, is_staff=True)
+        category = Category.objects.create(name='Книги', description='')
+        cls.book = Product.objects.create(name='Роман', description='', price=10, category=category)
+        cls.old = Order.objects.create(owner=cls.staff, total=10)
+        Order.objects.filter(pk=cls.old.pk).update(created_at=timezone.now() - timedelta(days=10))
+        cls.new = Order.objects.create(owner=cls.staff, total=20)
+        OrderItem.objects.create(order_item=cls.new, item=cls.book, product_quantity=2)
+
+    def test_requires_staff(self):
+        response = self.client.get(reverse('shop:export', args=['orders']))
+        self.assertEqual(response.status_code, 302)
+
+    def test_streams_csv_with_date_filter(self):
+        self.client.force_login(self.staff)
+        today = timezone.localdate().isoformat()
+        response = self.client.get(reverse('shop:export', args=['orders']), {'from': today, 'to': today})
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], ['id', 'owner__email', 'status', 'total', 'created_at'])
+        self.assertEqual([row[0] for row in rows[1:]], [str(self.new.pk)])
+
+    def test_order_items_jsonl_joins_in_sql(self):
+        columns, rows = export_rows('order_items')
+        with self.assertNumQueries(1):
+            rows = list(rows)
+        self.assertEqual(dict(zip(columns, rows[0]))['item__category__name'], 'Книги')
+
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('shop:export', args=['order_items']), {'format': 'jsonl'})
+        line = json.loads(b''.join(response.streaming_content).decode().splitlines()[0])
+        self.assertEqual((line['order_item__owner__email'], line['product_quantity']), ('staff@example.com', 2))
+
+
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        self.admin = CustomUser.objects.create_superuser('admin@example.com', 'password')
+        self.client.force_login(self.admin)
+
+    def changelist_queries(self, model, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(f'admin:shop_{model}_changelist'), params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_order_changelist_does_not_query_per_row(self):
+        Order.objects.create(owner=self.admin, total=1)
+        # Первый запрос обновляет срок сессии
+        self.changelist_queries('order')
+        small = self.changelist_queries('order')
+        for index in range(10):
+            owner = CustomUser.objects.create_user(f'user{index}@example.com', 'password')
+            Order.objects.create(owner=owner, total=1)
+        self.assertEqual(self.changelist_queries('order'), small)
+
+    def test_search_by_related_fields(self):
+        category = Category.objects.create(name='Книги', description='')
+        Product.objects.create(name='Роман', description='', price=1, category=category)
+        response = self.client.get(reverse('admin:shop_product_changelist'), {'q': 'Книги'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+        self.changelist_queries('order', q='admin@')
+        self.changelist_queries('customuser')
+
+    def test_estimated_count_after_deleting_last_rows(self):
+        category = Category.objects.create(name='Книги', description='')
+        for index in range(10):
+            Product.objects.create(name=f'Товар {index}', description='', price=1, category=category)
+        Product.objects.filter(pk__in=Product.objects.order_by('-pk').values('pk')[:5]).delete()
+
+        # Без статистики - точный COUNT(*), а не максимальный первичный ключ
+        self.assertEqual(EstimatedCountPaginator(Product.objects.order_by('pk'), 20).count, 5)
+
+        # После ANALYZE - оценка из sqlite_stat1
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        Product.objects.filter(pk=Product.objects.order_by('pk').values('pk')[:1]).delete()
+        self.assertEqual(EstimatedCountPaginator(Product.objects.order_by('pk'), 20).count, 5)
+        self.assertEqual(EstimatedCountPaginator(Product.objects.filter(category=category), 20).count, 4)
+
+
+class QueryPlanTests(TestCase):
+    """Горячие запросы должны идти по индексам, без полного чтения таблиц"""
+
+    def assertIndexed(self, queryset):
+        self.assertEqual(full_scans(queryset), [], str(queryset.query))
+
+    def test_order_history(self):
+        self.assertIndexed(Order.objects.filter(owner_id=1).order_by('-created_at'))
+
+    def test_order_export_range(self):
+        self.assertIndexed(Order.objects.filter(created_at__gte=timezone.now()).order_by('created_at'))
+
+    def test_catalog_pages(self):
+        category = Category.objects.create(name='Книги', description='')
+        cursor = encode_cursor(Product.objects.create(name='Роман', description='', price=1, category=category))
+        for products in (Product.objects.all(), Product.objects.filter(category=category)):
+            # Первая страница и продолжение по курсору - те же запросы, что строит keyset_page
+            self.assertIndexed(after_cursor(products)[:21])
+            continuation = after_cursor(products, cursor)[:21]
+            self.assertIndexed(continuation)
+            # Продолжение ищет границу курсора в индексе, а не читает его с начала
+            self.assertNotIn('SCAN', continuation.explain())
+
+    def test_product_feedback(self):
+        self.assertIndexed(Feedback.objects.filter(item_id=1).order_by('-created_at'))
+
+    def test_expired_deletion_tokens(self):
+        self.assertIndexed(AccountDeletion.objects.filter(created_at__lt=timezone.now()))
+
+
+class ConnectionProfileTests(TestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_applied_to_new_connection(self):
+        self.assertEqual(self.pragma('busy_timeout'), 5000)
+        self.assertEqual(self.pragma('synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma('temp_store'), 2)  # MEMORY
+        self.assertEqual(self.pragma('cache_size'), -20000)
+
+
+@override_settings(DATABASE_REPLICA='replica', REPLICA_PIN_SECONDS=10)
+class ReplicaRoutingTests(TestCase):
+    def test_reads_use_primary_outside_read_only_views(self):
+        self.assertEqual(router.db_for_read(Product), 'default')
+
+    def test_read_only_scope_uses_replica_until_first_write(self):
+        with replica_reads():
+            self.assertEqual(router.db_for_read(Product), 'replica')
+            self.assertEqual(router.db_for_write(Cart), 'default')
+            self.assertEqual(router.db_for_read(Product), 'default')
+
+    def test_write_pins_client_to_primary(self):
+        factory = RequestFactory()
+
+        def writing_view(request):
+            router.db_for_write(Cart)
+            return HttpResponse()
+
+        response = ReplicaPinMiddleware(writing_view)(factory.get('/'))
+        self.assertEqual(response.cookies[ReplicaPinMiddleware.COOKIE]['max-age'], 10)
+
+        @read_from_replica
+        def reading_view(request):
+            return HttpResponse(router.db_for_read(Product))
+
+        request = factory.get('/')
+        self.assertEqual(ReplicaPinMiddleware(reading_view)(request).content, b'replica')
+        request.COOKIES[ReplicaPinMiddleware.COOKIE] = '1'
+        self.assertEqual(ReplicaPinMiddleware(reading_view)(request).content, b'default')
+
+    @override_settings(DATABASE_REPLICA='default')
+    def test_profile_visit_does_not_pin_client(self):
+        user = CustomUser.objects.create_user('reader@example.com', 'password', is_active=True)
+        self.client.force_login(user)
+        # Первый запрос продлевает срок сессии - это запись
+        self.client.get(reverse('shop:profile'))
+        self.client.cookies.pop(ReplicaPinMiddleware.COOKIE, None)
+
+        response = self.client.get(reverse('shop:profile'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(ReplicaPinMiddleware.COOKIE, response.cookies)
+        self.assertFalse(Cart.objects.filter(user=user).exists())
+
+
+@override_settings(SQL_INSTRUMENTATION=True, SQL_N_PLUS_ONE_THRESHOLD=3)
+class QueryInstrumentationTests(TestCase):
+    def setUp(self):
+        for index in range(5):
+            category = Category.objects.create(name=f'Категория {index}', description='')
+            Product.objects.create(name=f'Товар {index}', description='', price=1, category=category)
+
+    def test_server_timing_and_log_line(self):
+        with self.assertLogs('shop.sql', 'INFO') as logs:
+            response = self.client.get(reverse('shop:catalog'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ SQL"$')
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['path'], reverse('shop:catalog'))
+        self.assertGreater(record['queries'], 0)
+        self.assertEqual(record['n_plus_one'], {})
+
+    def test_repeated_statement_flagged_as_n_plus_one(self):
+        def view(request):
+            names = [product.category.name for product in Product.objects.all()]
+            return HttpResponse(names)
+
+        with self.assertLogs('shop.sql', 'WARNING') as logs:
+            QueryInstrumentationMiddleware(view)(RequestFactory().get('/'))
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['queries'], 6)
+        self.assertEqual(list(record['n_plus_one'].values()), [5])
+
+    @override_settings(SQL_INSTRUMENTATION=False)
+    def test_disabled_middleware_leaves_chain(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            QueryInstrumentationMiddleware(HttpResponse)
+
+
+class BenchmarkViewsTests(TestCase):
+    def test_report_covers_all_scenarios(self):
+        out = StringIO()
+        call_command(
+            'benchmark_views', categories=2, products=10, users=2, orders_per_user=2,
+            workers=1, requests=2, stdout=out,
+        )
+        report = json.loads(out.getvalue())
+        self.assertEqual(set(report['scenarios']), {'login', 'add_to_cart', 'update_quantity', 'view_cart', 'profile'})
+        for name, result in report['scenarios'].items():
+            self.assertEqual((result['requests'], result['errors']), (2, 0), name)
+            self.assertEqual(set(result['latency_ms']), {'p50', 'p95', 'p99'})
+            self.assertGreater(result['queries_per_request'], 0)
+        self.assertFalse(CustomUser.objects.filter(email__startswith='loadtest-').exists())
+
+    def test_seeded_carts_reserve_stock(self):
+        call_command(
+            'benchmark_views', categories=1, products=5, users=2, orders_per_user=1, cart_items=2,
+            workers=1, requests=1, scenarios=['view_cart'], keep=True, stdout=StringIO(),
+        )
+        carts = Cart.objects.filter(user__email__startswith='loadtest-')
+        self.assertEqual([cart.items.count() for cart in carts], [2, 2])
+        for cart in carts:
+            self.assertEqual(cart.total, sum(line.item_price for line in cart.lines()))
+        reserved = CartItem.objects.filter(cart_item__in=carts).aggregate(total=Sum('product_quantity'))['total']
+        stock = Product.objects.filter(name__startswith='loadtest-').aggregate(total=Sum('stock_quantity'))['total']
+        self.assertEqual(stock + reserved, 5 * 1_000_000)
+
+    def test_percentile_is_nearest_rank(self):
+        values = list(range(1, 31))
+        self.assertEqual([percentile(values, percent) for percent in (50, 95, 99)], [15, 29, 30])
@@ -1,6 +1,6 @@
 from django.urls import path
 from .views import register, login, activate, profile, password_reset_confirm, password_reset_request, logout
-from .views import home, change_password, edit_profile, account_delete_request, account_delete_confirm
+from .views import home, change_password, edit_profile, account_delete_request, account_delete_confirm, catalog, search, export
 app_name = 'shop'
 
 urlpatterns = [
@@ -9,6 +9,9 @@ urlpatterns = [
     path('shop/login.html', login, name='login'),
     path('shop/logout.html/', logout, name='logout'),
     path('shop/profile/', profile, name='profile'),
+    path('shop/catalog/', catalog, name='catalog'),
+    path('shop/search/', search, name='search'),
+    path('shop/export/<str:kind>/', export, name='export'),
     path('activate/<uidb64>/<token>/', activate, name='activate'),
     path('password-reset/', password_reset_request, name='password_reset'),
     path('password-reset-confirm/<uidb64>/<token>/',
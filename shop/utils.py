@@ -0,0 +1,52 @@
+from datetime import datetime
+
+from django.db.models import Q
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+
+def encode_cursor(product):
+    """Курсор страницы каталога: дата создания и id последнего товара"""
+    return urlsafe_base64_encode(force_bytes(f'{product.created_at.isoformat()}|{product.pk}'))
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, pk = urlsafe_base64_decode(cursor).decode().split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        return None
+
+
+def after_cursor(queryset, cursor=None):
+    """Товары после курсора в порядке (-created_at, -id); без курсора - с начала"""
+    queryset = queryset.order_by('-created_at', '-id')
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        created_at, pk = position
+        # Отдельное условие created_at <= X даёт SQLite границу поиска по индексу,
+        # иначе из-за OR индекс читается с самого начала
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk), created_at__lte=created_at
+        )
+    return queryset
+
+
+def keyset_page(queryset, cursor=None, size=20):
+    """Страница товаров после курсора в порядке (-created_at, -id).
+
+    Стоимость не зависит от номера страницы: вместо OFFSET используется
+    условие по индексу. Возвращает список товаров и курсор следующей страницы.
+    """
+    products = list(after_cursor(queryset, cursor)[:size + 1])
+    next_cursor = encode_cursor(products[size - 1]) if len(products) > size else None
+    return products[:size], next_cursor
+
+
+def full_scans(queryset):
+    """Строки плана SQLite, где таблица читается целиком или сортируется во временном B-дереве"""
+    plan = queryset.explain().splitlines()
+    return [
+        line for line in plan
+        if ('SCAN ' in line and ' USING ' not in line) or 'USE TEMP B-TREE' in line
+    ]
@@ -1,22 +1,28 @@
-from django.contrib.sessions.models import Session
 from django.urls import reverse
 from django.shortcuts import render, redirect
-from .models import CustomUser, Order, Product
-from cart.models import Cart
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db.models import Prefetch
+from .models import Category, CustomUser, Order, OrderItem, Product
 from .forms import CustomUserCreationForm, CustomUserLoginForm, CustomPasswordResetForm, \
     ProfileEditForm, CustomPasswordChangeForm, CustomSetPasswordForm, AccountDeleteForm
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404, HttpResponseBadRequest, StreamingHttpResponse
 from django.contrib import messages
 from django.contrib.auth import login as auth_login, update_session_auth_hash
 from django.contrib.auth import logout as auth_logout
-from django.contrib.auth import authenticate
 from django.contrib.auth import get_user_model
-from django.core.mail import send_mail
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes
 from django.contrib.auth.tokens import default_token_generator
 from .models import AccountDeletion
-from cart.utils import get_or_create_cart
+from cart.utils import find_cart, get_cart
+from .utils import keyset_page
+from .routers import read_from_replica
+from .search import search_products
+from .outbox import queue_mail
+from .exports import EXPORTS, STREAMS, export_rows
 from cart.models import CartItem
 
 
@@ -40,8 +46,8 @@ def register(request):
             uid = urlsafe_base64_encode(force_bytes(user.pk))
             confirmation_link = request.build_absolute_uri(f'/activate/{uid}/{token}/')
 
-            # Отправка email с подтверждением
-            send_mail(
+            # Письмо с подтверждением отправит фоновый обработчик очереди
+            queue_mail(
                 'Подтверждение регистрации',
                 f'Перейдите по ссылке для активации: {confirmation_link}',
                 'admin@shop.com',
@@ -76,23 +82,10 @@ def login(request):
     if request.method == 'POST':
         form = CustomUserLoginForm(request, data=request.POST)
         if form.is_valid():
-            email = form.cleaned_data.get('email')
-            password = form.cleaned_data.get('password')
-
-            try:
-                # Пытаемся найти пользователя
-                user = authenticate(request, email=email, password=password)
-                if user is not None:
-                    auth_login(request, user)
-                    messages.success(request, "Вы успешно авторизированы!")
-                    return redirect('shop:profile')
-                else:
-                    messages.error(request, "Что то не так (email, пароль или нет активации")
-            except CustomUser.DoesNotExist:
-                # Обработка случая, когда пользователь не найден
-                messages.error(request, "Пользователь не найден")
-                return redirect('shop:login')
-
+            # Пароль уже проверен формой, повторная аутентификация не нужна
+            auth_login(request, form.get_user())
+            messages.success(request, "Вы успешно авторизированы!")
+            return redirect('shop:profile')
         else:
             messages.error(request, "Исправьте ошибки в форме.")
 
@@ -102,21 +95,6 @@ def login(request):
     return render(request, 'shop/login.html', {'form': form})
 
 
-def logout(request):
-    if request.user.is_authenticated:
-        # Переносим корзину в сессию перед выходом
-        user_cart = get_or_create_cart(request)
-        if user_cart.items.exists():
-            request.session.create()  # Новая сессия для сохранения корзины
-            session = Session.objects.get(session_key=request.session.session_key)
-            session_cart = Cart.objects.create(session=session)
-            user_cart.merge_with_session(session_cart)
-
-    auth_logout(request)
-    messages.success(request, "Вы успешно вышли. Ваша корзина сохранена.")
-    return redirect('shop:home')
-
-
 def password_reset_request(request):
     if request.method == "POST":
         form = CustomPasswordResetForm(request.POST)
@@ -132,12 +110,11 @@ def password_reset_request(request):
                 f'/password-reset-confirm/{uid}/{token}/'
             )
 
-            send_mail(
+            queue_mail(
                 'Сброс пароля',
                 f'Для сброса пароля перейдите по ссылке: {reset_link}',
                 'admin@shop.com',
                 [user.email],
-                fail_silently=False,
             )
 
             messages.success(request, 'Письмо с инструкциями по сбросу пароля отправлено на ваш email')
@@ -180,8 +157,8 @@ def profile(request):
 @login_required
 def logout(request):
     # Очистка корзины (если требуется)
-    cart = get_or_create_cart(request)
-    cart.items.all().delete()
+    cart = get_cart(request)
+    cart.clear()
 
     auth_logout(request)
     messages.success(request, "Вы успешно вышли из системы")
@@ -189,25 +166,75 @@ def logout(request):
 
 
 @login_required
+@read_from_replica
 def profile(request):
     user = request.user
-    orders = Order.objects.filter(owner=user).order_by('-created_at')
+    # Позиции заказов и товары загружаются двумя запросами на всю страницу
+    orders = Order.objects.filter(owner=user).order_by('-created_at').prefetch_related(
+        Prefetch('items', queryset=OrderItem.objects.select_related('item'))
+    )
+    orders_page = Paginator(orders, settings.ORDER_HISTORY_PAGE_SIZE).get_page(request.GET.get('page'))
 
-    cart = get_or_create_cart(request)
-    cart_items = cart.items.all()
-    final = cart.total
-    available_products = Product.objects.all()  # Товары для добавления в корзину
+    # Страница только читает: корзина не создаётся, иначе запись закрепила бы запрос за основной базой
+    cart = find_cart(request)
+    cart_items = cart.lines() if cart else []
+    final = cart.total if cart else 0
 
     return render(request, 'shop/profile.html', {
         'user': user,
-        'orders': orders,
+        'orders': orders_page,
         'cart': cart,
         'cart_items': cart_items,
-        'available_products': available_products,
         'total': final
     })
 
 
+@read_from_replica
+def catalog(request):
+    products = Product.objects.select_related('category')
+    category = None
+    category_id = request.GET.get('category')
+    if category_id and category_id.isdigit():
+        category = Category.objects.filter(pk=category_id).first()
+        products = Product.objects.in_category(category) if category else products.none()
+        products = products.select_related('category')
+
+    page, next_cursor = keyset_page(products, request.GET.get('cursor'), settings.CATALOG_PAGE_SIZE)
+    return render(request, 'shop/catalog.html', {
+        'products': page,
+        'category': category,
+        'breadcrumbs': category.get_breadcrumbs() if category else [],
+        'next_cursor': next_cursor,
+    })
+
+
+@staff_member_required
+@read_from_replica
+def export(request, kind):
+    file_format = request.GET.get('format', 'csv')
+    if kind not in EXPORTS or file_format not in STREAMS:
+        raise Http404
+    try:
+        columns, rows = export_rows(kind, request.GET.get('from'), request.GET.get('to'))
+    except (TypeError, ValueError):
+        return HttpResponseBadRequest('Даты указываются в формате ГГГГ-ММ-ДД')
+
+    content_type = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(STREAMS[file_format](columns, rows), content_type=f'{content_type}; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{file_format}"'
+    return response
+
+
+@read_from_replica
+def search(request):
+    query = request.GET.get('q', '').strip()
+    products = search_products(query, settings.CATALOG_PAGE_SIZE) if query else []
+    return render(request, 'shop/catalog.html', {
+        'products': products,
+        'query': query,
+    })
+
+
 @login_required
 def edit_profile(request):
     if request.method == 'POST':
@@ -258,12 +285,11 @@ def account_delete_request(request):
                     'token': token
                 })
             )
-            send_mail(
+            queue_mail(
                 'Подтверждение удаления аккаунта',
                 f'Для подтверждения удаления аккаунта перейдите по ссылке: {delete_link}',
                 'noreply@yoursite.com',
                 [request.user.email],
-                fail_silently=False,
             )
 
             messages.info(request, 'Письмо с подтверждением отправлено на ваш email')